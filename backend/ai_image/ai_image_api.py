@@ -1,18 +1,45 @@
 from flask import Flask, request, jsonify
 import urllib.parse
 import logging
-import requests
+try:
+    from net import http_client
+except ImportError:
+    # 单独运行模块时退回到 requests
+    import requests as http_client
 import os
 import time
 import hashlib
 import re
+import tempfile
+try:
+    from ai_image.image_probe import ImageProbe
+except ImportError:
+    from image_probe import ImageProbe
 try:
-    from PIL import Image
+    from monitoring.tracing import span, annotate
 except ImportError:
-    Image = None
+    # 单独运行模块时不记录阶段耗时
+    from contextlib import nullcontext
+
+    def span(name, **attrs):
+        return nullcontext()
+
+    def annotate(**attrs):
+        pass
 
 app = Flask(__name__)
 
+# 下载的壁纸大小限制
+MIN_IMAGE_BYTES = 1024
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 下载中的临时文件后缀，完成校验后才重命名为正式文件
+PARTIAL_SUFFIX = '.part'
+# 按内容命名时文件名中保留的 sha256 长度
+CONTENT_HASH_LENGTH = 12
+# 按实际识别到的图片格式确定保存的扩展名
+FORMAT_EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'gif': '.gif'}
+
 def generate_safe_filename(prompt, max_length=100):
     """
     根据提示词生成安全的文件名
@@ -48,53 +75,79 @@ def generate_safe_filename(prompt, max_length=100):
 
     return safe_filename
 
-def validate_image_file(file_path):
-    """验证图片文件的完整性"""
+def remove_partial_downloads(directory):
+    """清理进程异常退出时遗留的下载临时文件"""
     try:
-        # 检查文件是否存在
-        if not os.path.exists(file_path):
-            return False
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith('.') and name.endswith(PARTIAL_SUFFIX):
+            try:
+                os.remove(os.path.join(directory, name))
+                logging.info(f"remove_partial_downloads [清理] {name}")
+            except OSError:
+                pass
 
-        # 检查文件大小
-        file_size = os.path.getsize(file_path)
-        if file_size < 1024:  # 小于1KB认为无效
-            return False
+def _stream_to_temp_file(resp, local_path):
+    """
+    把响应分块写入与目标同目录的临时文件，边写边计算 sha256 并解析文件头
 
-        # 如果PIL可用，尝试打开图片验证格式
-        if Image:
-            try:
-                with Image.open(file_path) as img:
-                    # 验证图片格式
-                    img.verify()
-                    return True
-            except Exception as e:
-                logging.warning(f"validate_image_file [PIL验证失败] {file_path}: {e}")
-                return False
-        else:
-            # 如果PIL不可用，进行基本的文件头验证
-            with open(file_path, 'rb') as f:
-                header = f.read(16)
-                # 检查常见图片格式的文件头
-                if header.startswith(b'\xff\xd8\xff'):  # JPEG
-                    return True
-                elif header.startswith(b'\x89PNG\r\n\x1a\n'):  # PNG
-                    return True
-                elif header.startswith(b'GIF87a') or header.startswith(b'GIF89a'):  # GIF
-                    return True
-                elif header.startswith(b'RIFF') and b'WEBP' in header:  # WebP
-                    return True
-                else:
-                    logging.warning(f"validate_image_file [未知格式] {file_path}")
-                    return False
-    except Exception as e:
-        logging.error(f"validate_image_file [验证异常] {file_path}: {e}")
-        return False
-
-def download_wallpaper(prompt, local_path, max_retries=3, width=1920, height=1080, model="flux", seed=2, Enhance=False, nologo=True):
+    首个数据块用于识别图片格式，累计大小超过 MAX_IMAGE_BYTES 时立即中止。
+
+    Returns:
+        (临时文件路径, ImageProbe, sha256)，内容不符合要求时抛出 ValueError
+    """
+    content_length = resp.headers.get('Content-Length')
+    if content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES:
+        raise ValueError(f"文件过大 ({content_length} bytes)")
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.', suffix=PARTIAL_SUFFIX, dir=os.path.dirname(local_path) or '.')
+    sha256 = hashlib.sha256()
+    probe = ImageProbe()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                probe.feed(chunk)
+                if probe.size > MAX_IMAGE_BYTES:
+                    raise ValueError(f"文件过大 (超过 {MAX_IMAGE_BYTES} bytes)")
+                sha256.update(chunk)
+                f.write(chunk)
+        if probe.size < MIN_IMAGE_BYTES:
+            raise ValueError(f"文件过小 ({probe.size} bytes), 可能不是有效图片")
+    except Exception:
+        _remove_quietly(tmp_path)
+        raise
+    return tmp_path, probe, sha256.hexdigest()
+
+def _retry_wait(seconds, reason):
+    """重试前等待，等待时间单独记录为一个阶段"""
+    with span('retry_wait', seconds=seconds, reason=reason):
+        time.sleep(seconds)
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def download_wallpaper(prompt, local_path, max_retries=3, width=1920, height=1080, model="flux", seed=2, Enhance=False, nologo=True, on_progress=None, content_addressed=False):
     '''
     按1920*1080请求实际得到的宽高最大到1704*960
     model: flux, kontext, turbo, gptimage
     Enhance: 启用/禁用 Pollinations AI 提示增强器，它能通过优化你的文本提示，帮助你创造更出色的图像。
+    on_progress: 可选的阶段回调，参数为 'downloading' / 'validating'
+    content_addressed: 为 True 时在文件名中加入内容哈希，如 a_b.jpg -> a_b.<sha256前12位>.jpg，
+        同一个 URL 的内容永远不变，可以长期缓存
+    local_path 的扩展名会按下载内容的实际格式替换，如上游返回 PNG 时保存为 a_b.png
+
+    图片分块写入同目录的临时文件，校验通过后原子重命名为 local_path，
+    其他请求不会读到写了一半或校验失败的文件。
+
+    Returns:
+        成功时返回元数据字典 {'filename', 'size', 'sha256', 'format', 'width', 'height', 'downscaled'}，失败返回 False
     '''
     encoded_prompt = urllib.parse.quote(prompt)
     #  example: https://image.pollinations.ai/prompt/cyberpunk%20city%20at%20night?width=1920&height=1080&model=flux&seed=42&nologo=True&Enhance=True
@@ -105,44 +158,63 @@ def download_wallpaper(prompt, local_path, max_retries=3, width=1920, height=108
     }
 
     for attempt in range(max_retries):
-        try:
-            resp = requests.get(image_url, headers=headers, timeout=20)
-            if resp.status_code == 200:
-                # 检查响应内容是否为空
-                if not resp.content or len(resp.content) == 0:
-                    logging.warning(f"download_wallpaper [警告] 响应内容为空, 尝试 {attempt + 1}/{max_retries}")
-                    time.sleep(2)
-                    continue
-
-                # 检查内容长度是否合理（至少1KB）
-                if len(resp.content) < 1024:
-                    logging.warning(f"download_wallpaper [警告] 文件过小 ({len(resp.content)} bytes), 可能不是有效图片, 尝试 {attempt + 1}/{max_retries}")
-                    time.sleep(2)
-                    continue
-
-                # 写入文件
-                with open(local_path, 'wb') as f:
-                    f.write(resp.content)
-
-                # 验证文件完整性
-                if not validate_image_file(local_path):
-                    logging.warning(f"download_wallpaper [警告] 文件验证失败, 尝试 {attempt + 1}/{max_retries}")
-                    # 删除无效文件
+        tmp_path = None
+        with span('download_attempt', attempt=attempt + 1):
+            try:
+                if on_progress:
+                    on_progress('downloading')
+                with http_client.get(image_url, headers=headers, timeout=20, stream=True) as resp:
+                    annotate(status=resp.status_code)
+                    if resp.status_code != 200:
+                        logging.error(f"download_wallpaper [失败] 状态码 {resp.status_code}, 尝试 {attempt + 1}/{max_retries}")
+                        _retry_wait(5, f"状态码 {resp.status_code}")
+                        continue
                     try:
-                        os.remove(local_path)
-                    except:
-                        pass
-                    time.sleep(2)
+                        with span('stream_to_file'):
+                            tmp_path, probe, sha256 = _stream_to_temp_file(resp, local_path)
+                            annotate(bytes=probe.size, format=probe.format)
+                    except ValueError as e:
+                        logging.warning(f"download_wallpaper [警告] {e}, 尝试 {attempt + 1}/{max_retries}")
+                        _retry_wait(2, str(e))
+                        continue
+
+                # 验证文件完整性，下载过程中已解析过文件头和文件尾，无需重新读取
+                if on_progress:
+                    on_progress('validating')
+                with span('validate'):
+                    valid, reason = probe.validate()
+                if not valid:
+                    logging.warning(f"download_wallpaper [警告] 文件验证失败: {reason}, 尝试 {attempt + 1}/{max_retries}")
+                    _retry_wait(2, reason)
                     continue
 
-                logging.info(f"download_wallpaper [成功] 壁纸下载到: {local_path}, 大小: {len(resp.content)} bytes")
-                return True
-            else:
-                logging.error(f"download_wallpaper [失败] 状态码 {resp.status_code}, 尝试 {attempt + 1}/{max_retries}")
-                time.sleep(5)  # 等待后重试
-        except Exception as e:
-            logging.error(f"download_wallpaper [错误] 请求异常: {e}, 尝试 {attempt + 1}/{max_retries}")
-            time.sleep(2)
+                root, ext = os.path.splitext(local_path)
+                ext = FORMAT_EXTENSIONS.get(probe.format, ext)
+                if content_addressed:
+                    root = f"{root}.{sha256[:CONTENT_HASH_LENGTH]}"
+                final_path = root + ext
+                meta = {
+                    'filename': os.path.basename(final_path),
+                    'size': probe.size,
+                    'sha256': sha256,
+                    'format': probe.format,
+                    'width': probe.width,
+                    'height': probe.height,
+                    'downscaled': probe.width < width or probe.height < height
+                }
+                if meta['downscaled']:
+                    logging.info(f"download_wallpaper [提示] 请求 {width}x{height}, 实际得到 {probe.width}x{probe.height}")
+                os.replace(tmp_path, final_path)
+                tmp_path = None
+                logging.info(f"download_wallpaper [成功] 壁纸下载到: {final_path}, 大小: {meta['size']} bytes")
+                return meta
+            except Exception as e:
+                logging.error(f"download_wallpaper [错误] 请求异常: {e}, 尝试 {attempt + 1}/{max_retries}")
+                _retry_wait(2, str(e))
+            finally:
+                # 校验失败、重命名失败或其他异常时删除临时文件，成功重命名后 tmp_path 已置空
+                if tmp_path is not None:
+                    _remove_quietly(tmp_path)
 
     logging.error(f"download_wallpaper [终止] 多次尝试后仍失败, image_url: {image_url}")
     return False
@@ -0,0 +1,178 @@
+import struct
+
+# 为找到尺寸信息最多缓存的文件头字节数（JPEG 的 SOF 可能排在较大的 EXIF 之后）
+MAX_HEADER_BYTES = 512 * 1024
+# 保留的文件尾字节数，用于检查结束标记（有些 JPEG 在 EOI 之后还附带少量垃圾数据）
+TAIL_BYTES = 1024
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def sniff_image_format(header):
+    """根据文件头判断图片格式，无法识别时返回 None"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'GIF87a') or header.startswith(b'GIF89a'):
+        return 'gif'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def _jpeg_size(data):
+    """遍历 JPEG 段直到 SOF，返回 (width, height)；数据不够时返回 None"""
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("JPEG 段标记错误")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # 填充字节
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise ValueError("JPEG 缺少 SOF 段")
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def _png_size(data):
+    if len(data) < 24:
+        return None
+    if data[12:16] != b'IHDR':
+        raise ValueError("PNG 缺少 IHDR")
+    return struct.unpack('>II', data[16:24])
+
+
+def _gif_size(data):
+    if len(data) < 10:
+        return None
+    return struct.unpack('<HH', data[6:10])
+
+
+def _webp_size(data):
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        if data[23:26] != b'\x9d\x01\x2a':
+            raise ValueError("WebP VP8 起始码错误")
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        if data[20] != 0x2F:
+            raise ValueError("WebP VP8L 签名错误")
+        b0, b1, b2, b3 = data[21:25]
+        return 1 + (b0 | (b1 & 0x3F) << 8), 1 + (b1 >> 6 | b2 << 2 | (b3 & 0x0F) << 10)
+    if chunk == b'VP8X':
+        return 1 + int.from_bytes(data[24:27], 'little'), 1 + int.from_bytes(data[27:30], 'little')
+    raise ValueError(f"未知的 WebP 数据块 {chunk!r}")
+
+
+_SIZE_PARSERS = {'jpeg': _jpeg_size, 'png': _png_size, 'gif': _gif_size, 'webp': _webp_size}
+
+
+class ImageProbe:
+    """
+    增量解析图片文件头和文件尾，不解码像素
+
+    下载时每收到一块数据调用 feed()，只缓存找到尺寸所需的文件头和最后几个字节，
+    结束后 format、width、height 为识别结果，validate() 检查尺寸和文件是否完整
+    （JPEG 的 EOI、PNG 的 IEND、GIF 的结束符、WebP 的 RIFF 长度）。
+    """
+
+    def __init__(self):
+        self.format = None
+        self.width = None
+        self.height = None
+        self.size = 0
+        self.error = None
+        self._header = b''
+        self._tail = b''
+        self._riff_size = None
+
+    def feed(self, chunk):
+        """输入下一块数据，文件头无法识别时抛出 ValueError"""
+        if not chunk:
+            return
+        self.size += len(chunk)
+        self._tail = (self._tail + chunk[-TAIL_BYTES:])[-TAIL_BYTES:]
+        if self.width is not None or self.error is not None:
+            return
+        if len(self._header) < MAX_HEADER_BYTES:
+            self._header += chunk[:MAX_HEADER_BYTES - len(self._header)]
+        if self.format is None:
+            if len(self._header) < 12:
+                return
+            self.format = sniff_image_format(self._header)
+            if self.format is None:
+                raise ValueError(f"未知格式, 文件头: {self._header[:16]!r}")
+            if self.format == 'webp':
+                self._riff_size = struct.unpack('<I', self._header[4:8])[0] + 8
+        try:
+            size = _SIZE_PARSERS[self.format](self._header)
+        except (ValueError, struct.error) as e:
+            self.error = str(e)
+            return
+        if size is not None:
+            self.width, self.height = size
+            self._header = b''
+        elif len(self._header) >= MAX_HEADER_BYTES:
+            self.error = f"前 {MAX_HEADER_BYTES} 字节内未找到尺寸信息"
+
+    def complete(self):
+        """文件是否以该格式的结束标记收尾，用于发现被截断的下载"""
+        if self.format == 'jpeg':
+            return b'\xff\xd9' in self._tail
+        if self.format == 'png':
+            return b'IEND' in self._tail
+        if self.format == 'gif':
+            return self._tail.rstrip(b'\x00').endswith(b'\x3b')
+        if self.format == 'webp':
+            return self._riff_size is not None and self.size >= self._riff_size
+        return False
+
+    def validate(self):
+        """返回 (是否有效, 原因)"""
+        if self.format is None:
+            return False, "未知格式"
+        if self.error:
+            return False, self.error
+        if self.width is None:
+            return False, "文件头不完整"
+        if not self.width or not self.height:
+            return False, f"尺寸无效 {self.width}x{self.height}"
+        if not self.complete():
+            return False, "文件被截断"
+        return True, None
+
+
+def probe_image_file(path, chunk_size=64 * 1024):
+    """只读取文件头和文件尾解析图片信息"""
+    probe = ImageProbe()
+    with open(path, 'rb') as f:
+        while probe.width is None and probe.error is None:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            probe.feed(chunk)
+        # 尺寸已经找到，直接跳到文件尾
+        f.seek(0, 2)
+        end = f.tell()
+        if end > probe.size:
+            start = max(probe.size, end - TAIL_BYTES)
+            f.seek(start)
+            probe.size = start
+            probe.feed(f.read())
+    return probe
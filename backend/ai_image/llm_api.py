@@ -2,7 +2,18 @@
 import requests
 import urllib.parse
 import os
+import json
+import re
 import logging
+try:
+    from net import http_client
+except ImportError:
+    # 单独运行模块时退回到 requests
+    import requests as http_client
+try:
+    from ai_image.model_router import ModelRouter
+except ImportError:
+    from model_router import ModelRouter
 
 # 经过实际测试的绘画提示词生成推荐模型 (按优先级排序)
 RECOMMENDED_DRAWING_MODELS = [
@@ -13,6 +24,9 @@ RECOMMENDED_DRAWING_MODELS = [
     "openai"        # 备选4 - 基础可用
 ]
 
+# 根据各模型的实际耗时、失败率动态调整尝试顺序，并熔断持续失败的模型
+MODEL_ROUTER = ModelRouter(RECOMMENDED_DRAWING_MODELS)
+
 def is_valid_english_prompt(text):
     """检查生成的文本是否为有效的英文提示词"""
     if not text or len(text.strip()) < 5:
@@ -46,19 +60,13 @@ def generate_drawing_prompt(instruction, model="auto"):
         instruction = f"将以下描述转换为专业的英文AI绘画提示词，只输出英文提示词，不要输出任何解释或其他内容：{instruction}"
 
     if model == "auto":
-        # 按推荐顺序尝试模型
-        for model_name in RECOMMENDED_DRAWING_MODELS:
-            try:
-                result = generate_text_with_model(instruction, model_name, "creative")
-                if is_valid_english_prompt(result):
-                    logging.info(f"使用模型: {model_name}")
-                    return result.strip()
-            except Exception as e:
-                logging.warning(f"模型 {model_name} 失败: {e}")
-                continue
-
-        # 如果所有模型都失败，抛出异常
-        raise Exception("所有推荐模型都无法生成有效的绘画提示词")
+        # 按模型路由的动态排名尝试
+        model_name, result = MODEL_ROUTER.route(
+            lambda m: generate_text_with_model(instruction, m, "creative"),
+            is_valid_english_prompt
+        )
+        logging.info(f"使用模型: {model_name}")
+        return result.strip()
     else:
         # 使用指定模型
         result = generate_text_with_model(instruction, model, "creative")
@@ -66,6 +74,73 @@ def generate_drawing_prompt(instruction, model="auto"):
             raise Exception(f"模型 {model} 生成的结果不符合要求: {result}")
         return result.strip()
 
+def parse_prompt_list(text):
+    """
+    从模型输出中解析提示词列表
+
+    优先按JSON数组解析（允许包裹在```代码块或前后有多余文字），
+    失败时按行拆分并去掉序号、引号等修饰。
+    """
+    if not text:
+        return []
+    text = text.strip()
+    start, end = text.find('['), text.rfind(']')
+    if start != -1 and end > start:
+        try:
+            items = json.loads(text[start:end + 1])
+            if isinstance(items, list):
+                return [item.strip() if isinstance(item, str) else
+                        str(item.get('prompt', '')).strip() if isinstance(item, dict) else str(item).strip()
+                        for item in items]
+        except ValueError:
+            pass
+    items = []
+    for line in text.splitlines():
+        line = re.sub(r'^\s*(```\w*|[-*•]|\d+\s*[.)、:])\s*', '', line).strip().strip('",').strip()
+        if line and not line.startswith('```'):
+            items.append(line)
+    return items
+
+def generate_drawing_prompts_batch(instruction, n, model="auto"):
+    """
+    一次请求生成多条英文AI绘画提示词
+
+    Args:
+        instruction: 单条提示词的完整指令
+        n: 需要的提示词数量
+        model: 使用的模型，auto会按模型路由的排名尝试
+
+    Returns:
+        校验通过的提示词列表，单条无效时丢弃该条，数量可能少于 n
+    """
+    batch_instruction = (
+        f"{instruction}\n\n"
+        f"请一次生成{n}条互不相同的提示词（场景细节、构图、色调各不相同），"
+        f"以JSON字符串数组格式输出，例如 [\"prompt 1\", \"prompt 2\"]，不要输出其他内容。"
+    )
+
+    def _valid_items(text, report=False):
+        items = parse_prompt_list(text)
+        valid = [item for item in items if is_valid_english_prompt(item)]
+        if report and len(valid) < len(items):
+            logging.warning(f"批量生成中 {len(items) - len(valid)}/{len(items)} 条提示词无效，已丢弃")
+        # 去重并保持顺序
+        return list(dict.fromkeys(valid))[:n]
+
+    if model == "auto":
+        model_name, result = MODEL_ROUTER.route(
+            lambda m: generate_text_with_model(batch_instruction, m, "creative"),
+            lambda text: len(_valid_items(text)) > 0
+        )
+        logging.info(f"使用模型: {model_name}")
+    else:
+        result = generate_text_with_model(batch_instruction, model, "creative")
+    prompts = _valid_items(result, report=True)
+    if not prompts:
+        raise Exception(f"模型 {model} 批量生成的结果不符合要求: {result}")
+    logging.info(f"批量生成提示词 {len(prompts)}/{n} 条")
+    return prompts
+
 # 经过实际测试的可用模型列表 (2025-01-16 测试)
 AVAILABLE_MODELS = {
     # 免费且稳定的模型
@@ -89,6 +164,10 @@ UNAVAILABLE_MODELS = {
     "gemini-2.0-flash-thinking-exp": "Gemini 模型 (不支持)"
 }
 
+def get_model_ranking():
+    """绘画提示词模型的当前排名和统计"""
+    return MODEL_ROUTER.ranking()
+
 def get_recommended_models():
     """获取推荐的模型列表"""
     free_models = [
@@ -118,7 +197,7 @@ def test_model(model_name, test_prompt="Hello"):
 
     try:
         proxies = {'http': None, 'https': None}
-        response = requests.get(url, proxies=proxies, timeout=10)
+        response = http_client.get(url, proxies=proxies, timeout=10)
 
         if response.status_code == 200:
             return True, response.text[:50] + "..." if len(response.text) > 50 else response.text
@@ -169,7 +248,7 @@ def generate_text_with_model(prompt, model="auto", task_type="general"):
             'https': None,
         }
 
-        response = requests.get(url, proxies=proxies, timeout=30)
+        response = http_client.get(url, proxies=proxies, timeout=30)
 
         if response.status_code == 402:
             raise Exception(f"模型 {model} 需要付费")
@@ -1,14 +1,67 @@
 import random
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 try:
-    from ai_image.llm_api import generate_drawing_prompt
+    from ai_image.llm_api import generate_drawing_prompt, generate_drawing_prompts_batch
+    from ai_image.prompt_cache import PromptCache, PromptPool
 except ImportError:
-    from llm_api import generate_drawing_prompt
+    from llm_api import generate_drawing_prompt, generate_drawing_prompts_batch
+    from prompt_cache import PromptCache, PromptPool
+try:
+    from monitoring.tracing import span
+except ImportError:
+    # 单独运行模块时不记录阶段耗时
+    from contextlib import nullcontext
+
+    def span(name, **attrs):
+        return nullcontext()
+
+# 随机选择的场景类型
+SCENE_TYPES = [
+    # 自然风景
+    "山川景观（高山、峡谷、山谷）",
+    "河流景观（河流、瀑布、溪流）",
+    "海洋景观（海岸、海滩、悬崖）",
+    "森林景观（密林、树林、竹林）",
+    "草原景观（草地、平原、牧场）",
+    "湖泊景观（湖泊、池塘、湿地）",
+    "沙漠景观（沙丘、绿洲、戈壁）",
+    "田园景观（农田、乡村、花园）",
+
+    # 吉卜力风格二次元场景
+    "吉卜力风格樱花庭院（传统石灯笼、青苔石径、花瓣轻舞飞扬）",
+    "吉卜力风格天空之城（漂浮岛屿、古老机械、云海环绕）",
+    "吉卜力风格魔法森林（参天古树、神秘光斑、精灵踪迹）",
+    "吉卜力风格乡村小镇（欧式小屋、石板路、温暖灯光）",
+    "吉卜力风格海边悬崖（草原小屋、海风吹拂、无垠海景）",
+    "吉卜力风格山谷农场（梯田、风车、田园诗意）",
+    "吉卜力风格秋日枫林（红叶满山、小径蜿蜒、诗意氛围）",
+    "吉卜力风格湖心小岛（宁静湖面、小木屋、倒影如镜）",
+    "吉卜力风格花海草原（五彩花田、微风轻抚、远山如黛）",
+    "吉卜力风格古老城堡（藤蔓缠绕、时光沉淀、神秘优雅）",
+    "吉卜力风格竹林小径（翠竹摇曳、光影斑驳、禅意悠远）",
+    "吉卜力风格云端花园（天空花园、彩云飘渺、梦幻仙境）"
+]
+
+# 按 (season, time_mood, weather_key, 场景类型) 缓存LLM生成的提示词
+PROMPT_CACHE = PromptCache()
+# 持久化的提示词池，由 init_prompt_pool() 初始化
+PROMPT_POOL = None
+
+def get_season(now=None):
+    month = (now or datetime.now()).month
+    if 3 <= month <= 5:
+        return "spring"
+    elif 6 <= month <= 8:
+        return "summer"
+    elif 9 <= month <= 11:
+        return "autumn"
+    else:
+        return "winter"
 
 # 简单按季节模拟日落时间（实际应用需接入天文API）
-def get_sunset_hour():
-    month = datetime.now().month
+def get_sunset_hour(now=None):
+    month = (now or datetime.now()).month
     if 3 <= month <= 5:   # 春季：约18:30-19:00日落
         return 18 + 0.5  # 18:30
     elif 6 <= month <= 8: # 夏季：约19:00-19:30日落
@@ -18,10 +71,11 @@ def get_sunset_hour():
     else:                # 冬季：约16:30-17:00日落
         return 16 + 0.75 # 16:45
 
-def get_time_mood():
+def get_time_mood(now=None):
+    now = now or datetime.now()
     # 获取当前时间的小时数,带小数点
-    current_hour = datetime.now().hour + datetime.now().minute / 60.0  # 转换为小时带小数点
-    sunset_hour = get_sunset_hour()
+    current_hour = now.hour + now.minute / 60.0  # 转换为小时带小数点
+    sunset_hour = get_sunset_hour(now)
     if 3 <= current_hour < 6:
         return "dawn"
     elif 6 <= current_hour < 9:
@@ -43,6 +97,28 @@ def get_time_mood():
     else:
         return "midnight"
 
+def get_time_mood_boundaries(day):
+    """返回某一天所有时间段的起始时刻（按时间排序）"""
+    sunset_hour = get_sunset_hour(day)
+    start = datetime(day.year, day.month, day.day)
+    hours = [0, 3, 6, 9, 12, 15, sunset_hour - 1, sunset_hour, sunset_hour + 0.5, sunset_hour + 1]
+    return sorted(start + timedelta(hours=h) for h in hours)
+
+def get_next_time_mood_boundary(now=None):
+    """
+    计算下一个时间段切换时刻
+
+    Returns:
+        (切换时刻, 切换后的time_mood)
+    """
+    now = now or datetime.now()
+    for day in (now, now + timedelta(days=1)):
+        for boundary in get_time_mood_boundaries(day):
+            if boundary > now:
+                return boundary, get_time_mood(boundary)
+    # 不会走到这里，第二天的0点一定晚于now
+    raise ValueError(f"无法计算下一个时间段切换时刻: {now}")
+
 def get_weather_key(weather: str) -> str:
     if '雨' in weather:
         return '雨'
@@ -214,9 +290,9 @@ def make_draw_prompt_rule_based(time_mood: str, weather_key: str) -> str:
     out_prompts = f"{random_scene_prompts}, {time_prompts[time_mood]}, {weather_modifiers[weather_key]}, {base_prompts}"
     return out_prompts
 
-def get_current_time_info() -> dict:
+def get_current_time_info(now=None) -> dict:
     """获取当前时间信息"""
-    now = datetime.now()
+    now = now or datetime.now()
     return {
         'month': now.month,
         'day': now.day,
@@ -224,9 +300,9 @@ def get_current_time_info() -> dict:
         'minute': now.minute
     }
 
-def create_ai_prompt_for_drawing(weather_key: str) -> str:
-    """为AI生成创建绘画提示词的指令"""
-    time_info = get_current_time_info()
+def create_ai_prompt_for_drawing(weather_key: str, scene: str = None, now: datetime = None) -> str:
+    """为AI生成创建绘画提示词的指令，scene/now 缺省时随机选择场景、使用当前时间"""
+    time_info = get_current_time_info(now)
 
     weather_descriptions = {
         '晴': "晴天",
@@ -239,34 +315,7 @@ def create_ai_prompt_for_drawing(weather_key: str) -> str:
 
     weather_desc = weather_descriptions.get(weather_key, "晴天")
 
-    # 随机选择场景类型
-    scene_types = [
-        # 自然风景
-        "山川景观（高山、峡谷、山谷）",
-        "河流景观（河流、瀑布、溪流）",
-        "海洋景观（海岸、海滩、悬崖）",
-        "森林景观（密林、树林、竹林）",
-        "草原景观（草地、平原、牧场）",
-        "湖泊景观（湖泊、池塘、湿地）",
-        "沙漠景观（沙丘、绿洲、戈壁）",
-        "田园景观（农田、乡村、花园）",
-
-        # 吉卜力风格二次元场景
-        "吉卜力风格樱花庭院（传统石灯笼、青苔石径、花瓣轻舞飞扬）",
-        "吉卜力风格天空之城（漂浮岛屿、古老机械、云海环绕）",
-        "吉卜力风格魔法森林（参天古树、神秘光斑、精灵踪迹）",
-        "吉卜力风格乡村小镇（欧式小屋、石板路、温暖灯光）",
-        "吉卜力风格海边悬崖（草原小屋、海风吹拂、无垠海景）",
-        "吉卜力风格山谷农场（梯田、风车、田园诗意）",
-        "吉卜力风格秋日枫林（红叶满山、小径蜿蜒、诗意氛围）",
-        "吉卜力风格湖心小岛（宁静湖面、小木屋、倒影如镜）",
-        "吉卜力风格花海草原（五彩花田、微风轻抚、远山如黛）",
-        "吉卜力风格古老城堡（藤蔓缠绕、时光沉淀、神秘优雅）",
-        "吉卜力风格竹林小径（翠竹摇曳、光影斑驳、禅意悠远）",
-        "吉卜力风格云端花园（天空花园、彩云飘渺、梦幻仙境）"
-    ]
-
-    selected_scene = random.choice(scene_types)
+    selected_scene = scene or random.choice(SCENE_TYPES)
 
     # 判断是否为吉卜力风格场景
     is_ghibli_scene = "吉卜力" in selected_scene
@@ -316,31 +365,87 @@ def create_ai_prompt_for_drawing(weather_key: str) -> str:
 
     return prompt
 
-def make_draw_prompt(time_mood: str, weather_key: str) -> str:
+def get_time_mood_sample_time(time_mood: str, day: datetime = None) -> datetime:
+    """返回某天中属于该时间段的一个代表时刻（时间段的中点）"""
+    day = day or datetime.now()
+    boundaries = get_time_mood_boundaries(day)
+    boundaries.append(boundaries[0] + timedelta(days=1))
+    for start, end in zip(boundaries, boundaries[1:]):
+        if get_time_mood(start) == time_mood:
+            return start + (end - start) / 2
+    raise ValueError(f"未知的时间段: {time_mood}")
+
+def generate_pool_prompts(key, count):
+    """为提示词池一次请求生成 count 条提示词，只补充当前季节"""
+    season, time_mood, weather_key = key
+    if season != get_season():
+        return None
+    instruction = create_ai_prompt_for_drawing(weather_key, now=get_time_mood_sample_time(time_mood))
+    return generate_drawing_prompts_batch(instruction, count, model="auto")
+
+def init_prompt_pool(path: str):
+    """初始化持久化提示词池并启动后台补充"""
+    global PROMPT_POOL
+    PROMPT_POOL = PromptPool(path, generate_pool_prompts)
+    PROMPT_POOL.start()
+    return PROMPT_POOL
+
+def get_prompt_cache_stats() -> dict:
+    return {
+        'cache': PROMPT_CACHE.stats(),
+        'pool': PROMPT_POOL.stats() if PROMPT_POOL else None
+    }
+
+def make_draw_prompt(time_mood: str, weather_key: str, allow_cached: bool = True, recently_used=None) -> str:
     """
     生成绘画提示词的主函数
-    优先使用AI生成（基于真实时间），失败时降级到基于规则的生成
+    优先从提示词池取用，其次使用缓存，再使用AI生成（基于真实时间），失败时降级到基于规则的生成
 
     Args:
-        time_mood: 时间情绪 (保留兼容性，但AI生成时会忽略)
+        time_mood: 时间情绪 (用于提示词池和缓存分组，AI生成时会忽略)
         weather_key: 天气关键词 (晴, 雨, 多云, etc.)
+        allow_cached: 是否允许使用缓存中已经用过的提示词，手动刷新时应为 False
+        recently_used: recently_used(prompt) -> bool，缓存的提示词对应的壁纸最近刚展示过时返回 True；
+            同一提示词生成的图片相同，这样的缓存条目会被移除并重新生成，避免"换"成刚看过的壁纸
 
     Returns:
         英文绘画提示词
     """
+    season = get_season()
+    if PROMPT_POOL is not None:
+        pooled = PROMPT_POOL.take((season, time_mood, weather_key))
+        if pooled:
+            logging.info(f"使用提示词池: {pooled[:50]}...")
+            return pooled
+
+    scene = random.choice(SCENE_TYPES)
+    cache_key = (season, time_mood, weather_key, scene)
+    if allow_cached:
+        cached = PROMPT_CACHE.get(cache_key)
+        if cached and recently_used is not None and recently_used(cached):
+            logging.info(f"缓存的提示词对应的壁纸最近已展示过，重新生成: {cached[:50]}...")
+            PROMPT_CACHE.discard(cache_key)
+        elif cached:
+            logging.info(f"使用缓存的提示词: {cached[:50]}...")
+            return cached
+
     # 创建AI生成指令
-    ai_instruction = create_ai_prompt_for_drawing(weather_key)
+    with span('create_ai_prompt_for_drawing', scene=scene):
+        ai_instruction = create_ai_prompt_for_drawing(weather_key, scene)
 
     try:
         # 优先尝试AI生成（让AI自己判断时间和天气）
-        ai_prompt = generate_drawing_prompt(ai_instruction, model="auto")
+        with span('generate_drawing_prompt'):
+            ai_prompt = generate_drawing_prompt(ai_instruction, model="auto")
         time_info = get_current_time_info()
         logging.info(f"AI生成成功: {time_info['month']}月{time_info['day']}日{time_info['hour']}点{weather_key}天 -> {ai_prompt[:50]}...")
+        PROMPT_CACHE.put(cache_key, ai_prompt)
         return ai_prompt
     except Exception as e:
         # AI生成失败，降级到基于规则的生成
         logging.warning(f"AI生成失败: {e}")
         logging.info("降级到规则生成")
-        rule_based_prompt = make_draw_prompt_rule_based(time_mood, weather_key)
+        with span('rule_based_prompt'):
+            rule_based_prompt = make_draw_prompt_rule_based(time_mood, weather_key)
         logging.info(f"规则生成完成: {rule_based_prompt[:50]}...")
-        return rule_based_prompt
\ No newline at end of file
+        return rule_based_prompt
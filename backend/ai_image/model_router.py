@@ -0,0 +1,212 @@
+import logging
+import queue
+import threading
+import time
+
+# 熔断器状态
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+
+class ModelRouter:
+    """
+    按历史表现动态排序的LLM模型路由
+
+    每个模型记录平均耗时、请求失败率和结果被判为无效的比例，按综合评分排序尝试。
+    连续失败达到 failure_threshold 次的模型熔断 cooldown 秒，之后放行一次探测请求，
+    探测成功恢复，失败则继续熔断。
+
+    Args:
+        models: 候选模型列表，初始顺序即为默认优先级
+        failure_threshold: 连续失败多少次后熔断
+        cooldown: 熔断持续时间（秒）
+        race: 是否同时请求排名前两位的模型，取先返回的有效结果
+        failure_penalty_ms: 失败或结果无效时计入的耗时，通常取请求超时时间
+        on_record: 每次调用结束后回调 on_record(model, elapsed_ms, outcome)，用于上报指标
+    """
+
+    def __init__(self, models, failure_threshold=3, cooldown=300, race=False, failure_penalty_ms=30000,
+                 on_record=None):
+        self.models = list(models)
+        self.on_record = on_record
+        self.failure_penalty_ms = failure_penalty_ms
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.race = race
+        self._lock = threading.Lock()
+        self._stats = {
+            model: {
+                'calls': 0, 'errors': 0, 'rejections': 0, 'successes': 0,
+                'ewma_ms': None, 'consecutive_failures': 0,
+                'circuit': CIRCUIT_CLOSED, 'opened_at': None, 'probing': False
+            }
+            for model in self.models
+        }
+
+    def _measured_score(self, stats):
+        calls = stats['calls'] or 1
+        bad_rate = (stats['errors'] + stats['rejections']) / calls
+        return stats['ewma_ms'] * (1 + 4 * bad_rate)
+
+    def _prior_score(self):
+        """
+        没有数据的模型的预估评分（毫秒）：已测模型评分的中位数，不超过 failure_penalty_ms
+
+        未测模型排在表现优于中位数的模型之后、明显变差或失败的模型之前；
+        还没有任何数据时为 failure_penalty_ms
+        """
+        scores = sorted(self._measured_score(s) for s in self._stats.values() if s['ewma_ms'] is not None)
+        if not scores:
+            return self.failure_penalty_ms
+        mid = len(scores) // 2
+        median = scores[mid] if len(scores) % 2 else (scores[mid - 1] + scores[mid]) / 2
+        return min(median, self.failure_penalty_ms)
+
+    def _score(self, model, prior=None):
+        stats = self._stats[model]
+        if stats['ewma_ms'] is None:
+            # 与已测模型同样以毫秒计，再加上默认优先级，同分时已测模型在前、未测模型保持配置顺序
+            prior = self._prior_score() if prior is None else prior
+            return prior + self.models.index(model) + 1
+        return self._measured_score(stats)
+
+    def _available(self, model, now):
+        """熔断器检查，半开状态只放行一个探测请求"""
+        stats = self._stats[model]
+        if stats['circuit'] == CIRCUIT_OPEN and now - stats['opened_at'] >= self.cooldown:
+            stats['circuit'] = CIRCUIT_HALF_OPEN
+            logging.info(f"[model_router] 模型 {model} 熔断结束，进入半开状态")
+        if stats['circuit'] == CIRCUIT_OPEN:
+            return False
+        if stats['circuit'] == CIRCUIT_HALF_OPEN:
+            return not stats['probing']
+        return True
+
+    def candidates(self):
+        """当前可用的模型，半开状态的模型排在最前面做探测，其余按评分从好到差排列"""
+        now = time.time()
+        with self._lock:
+            available = [m for m in self.models if self._available(m, now)]
+            prior = self._prior_score()
+            return sorted(available, key=lambda m: (self._stats[m]['circuit'] != CIRCUIT_HALF_OPEN,
+                                                    self._score(m, prior)))
+
+    def record(self, model, elapsed_ms, outcome):
+        """
+        记录一次调用结果
+
+        Args:
+            outcome: 'success' / 'error' / 'rejected'
+        """
+        if self.on_record is not None:
+            # 上报实际耗时，不计入失败惩罚
+            self.on_record(model, elapsed_ms, outcome)
+        with self._lock:
+            stats = self._stats[model]
+            stats['calls'] += 1
+            stats['probing'] = False
+            if outcome != 'success':
+                # 失败的调用即使很快返回也不能让模型排到前面
+                elapsed_ms = max(elapsed_ms, self.failure_penalty_ms)
+            if stats['ewma_ms'] is None:
+                stats['ewma_ms'] = elapsed_ms
+            else:
+                stats['ewma_ms'] = 0.7 * stats['ewma_ms'] + 0.3 * elapsed_ms
+            if outcome == 'success':
+                stats['successes'] += 1
+                stats['consecutive_failures'] = 0
+                if stats['circuit'] != CIRCUIT_CLOSED:
+                    logging.info(f"[model_router] 模型 {model} 探测成功，恢复使用")
+                stats['circuit'] = CIRCUIT_CLOSED
+                return
+            stats['errors' if outcome == 'error' else 'rejections'] += 1
+            stats['consecutive_failures'] += 1
+            if stats['circuit'] == CIRCUIT_HALF_OPEN or stats['consecutive_failures'] >= self.failure_threshold:
+                if stats['circuit'] != CIRCUIT_OPEN:
+                    logging.warning(f"[model_router] 模型 {model} 连续失败 {stats['consecutive_failures']} 次，熔断 {self.cooldown}s")
+                stats['circuit'] = CIRCUIT_OPEN
+                stats['opened_at'] = time.time()
+
+    def _call(self, model, call, validate):
+        with self._lock:
+            if self._stats[model]['circuit'] == CIRCUIT_HALF_OPEN:
+                self._stats[model]['probing'] = True
+        start = time.perf_counter()
+        try:
+            result = call(model)
+        except Exception:
+            self.record(model, (time.perf_counter() - start) * 1000, 'error')
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not validate(result):
+            self.record(model, elapsed_ms, 'rejected')
+            raise Exception(f"模型 {model} 生成的结果不符合要求")
+        self.record(model, elapsed_ms, 'success')
+        return result
+
+    def route(self, call, validate):
+        """
+        按排名依次调用模型，返回 (模型名, 结果)
+
+        Args:
+            call: call(model) -> str
+            validate: validate(result) -> bool
+        """
+        candidates = self.candidates()
+        if not candidates:
+            # 全部熔断时仍按默认顺序尝试，避免彻底不可用
+            candidates = list(self.models)
+        if self.race and len(candidates) >= 2:
+            try:
+                return self._race(candidates[:2], call, validate)
+            except Exception as e:
+                logging.warning(f"[model_router] 竞速请求均失败: {e}")
+                candidates = candidates[2:]
+        for model in candidates:
+            try:
+                return model, self._call(model, call, validate)
+            except Exception as e:
+                logging.warning(f"模型 {model} 失败: {e}")
+        raise Exception("所有推荐模型都无法生成有效的绘画提示词")
+
+    def _race(self, models, call, validate):
+        results = queue.Queue()
+
+        def _run(model):
+            try:
+                results.put((model, self._call(model, call, validate), None))
+            except Exception as e:
+                results.put((model, None, e))
+
+        for model in models:
+            threading.Thread(target=_run, args=(model,), daemon=True).start()
+        last_error = None
+        for _ in models:
+            model, result, error = results.get()
+            if error is None:
+                return model, result
+            last_error = error
+        raise last_error
+
+    def ranking(self):
+        """当前排名和各模型统计"""
+        now = time.time()
+        with self._lock:
+            for model in self.models:
+                self._available(model, now)
+            prior = self._prior_score()
+            ranked = sorted(self.models, key=lambda m: self._score(m, prior))
+            return [
+                {
+                    'model': model,
+                    'score': round(self._score(model, prior), 1),
+                    'calls': s['calls'],
+                    'error_rate': round(s['errors'] / s['calls'], 3) if s['calls'] else None,
+                    'rejection_rate': round(s['rejections'] / s['calls'], 3) if s['calls'] else None,
+                    'avg_ms': round(s['ewma_ms'], 1) if s['ewma_ms'] is not None else None,
+                    'circuit': s['circuit']
+                }
+                for model in ranked
+                for s in (self._stats[model],)
+            ]
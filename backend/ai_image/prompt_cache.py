@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class PromptCache:
+    """
+    带过期时间和容量上限的提示词缓存（LRU）
+
+    Args:
+        ttl: 过期时间（秒）
+        max_size: 最多缓存的条目数
+    """
+
+    def __init__(self, ttl=6 * 3600, max_size=256):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'discarded': 0}
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or now - item[1] > self.ttl:
+                if item is not None:
+                    del self._items[key]
+                self._stats['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self._stats['hits'] += 1
+            return item[0]
+
+    def put(self, key, prompt):
+        with self._lock:
+            self._items[key] = (prompt, time.time())
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def discard(self, key):
+        """get() 命中后发现条目不能再使用时调用：移除条目，这次 get() 改计入 discarded 而不是命中"""
+        with self._lock:
+            if self._items.pop(key, None) is not None:
+                self._stats['hits'] -= 1
+                self._stats['discarded'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'size': len(self._items)}
+
+
+class PromptPool:
+    """
+    持久化的已校验提示词池
+
+    按 (season, time_mood, weather_key) 分组保存LLM生成且校验通过的提示词，
+    取用时立即返回并从池中移除；后台线程为最近被请求过的分组补充到 target_size。
+
+    Args:
+        path: JSON 文件路径
+        generate: 批量生成提示词的函数 generate(key, count) -> list，返回 None 表示该分组不再需要补充
+        target_size: 每个分组保留的提示词数量
+        refill_interval: 补充线程的最长休眠时间（秒）
+    """
+
+    def __init__(self, path, generate, target_size=3, refill_interval=600):
+        self.path = path
+        self.generate = generate
+        self.target_size = target_size
+        self.refill_interval = refill_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pool = {}
+        self._wanted = set()
+        self._stats = {'hits': 0, 'misses': 0, 'refilled': 0, 'refill_errors': 0}
+        self._load()
+
+    @staticmethod
+    def _encode_key(key):
+        return '|'.join(key)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._pool = {tuple(k.split('|')): list(v) for k, v in data.items() if v}
+            self._wanted = set(self._pool)
+            logging.info(f"[prompt_pool] 已加载 {sum(len(v) for v in self._pool.values())} 条提示词")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"[prompt_pool] 读取提示词池失败: {e}")
+
+    def _save(self):
+        with self._lock:
+            data = {self._encode_key(k): v for k, v in self._pool.items() if v}
+        tmp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.warning(f"[prompt_pool] 保存提示词池失败: {e}")
+
+    def take(self, key):
+        """取出一条提示词，没有时返回 None，并安排后台补充该分组"""
+        with self._lock:
+            self._wanted.add(key)
+            prompts = self._pool.get(key)
+            prompt = prompts.pop(0) if prompts else None
+            self._stats['hits' if prompt else 'misses'] += 1
+        if prompt:
+            self._save()
+        self._wake.set()
+        return prompt
+
+    def add_many(self, key, prompts):
+        if not prompts:
+            return
+        with self._lock:
+            self._pool.setdefault(key, []).extend(prompts)
+        self._save()
+
+    def start(self):
+        threading.Thread(target=self._refill_loop, name='prompt-pool-refill', daemon=True).start()
+
+    def _refill_loop(self):
+        while True:
+            self._wake.wait(self.refill_interval)
+            self._wake.clear()
+            for key, count in self._missing_keys():
+                # 每个分组一次请求补齐缺少的数量
+                try:
+                    prompts = self.generate(key, count)
+                except Exception as e:
+                    logging.warning(f"[prompt_pool] 补充提示词失败 {key}: {e}")
+                    self._stats['refill_errors'] += 1
+                    continue
+                if prompts is None:
+                    # generate 返回 None 表示该分组当前不需要补充（如已换季）
+                    with self._lock:
+                        self._wanted.discard(key)
+                    continue
+                self.add_many(key, prompts[:count])
+                self._stats['refilled'] += len(prompts[:count])
+
+    def _missing_keys(self):
+        with self._lock:
+            missing = [(key, self.target_size - len(self._pool.get(key, []))) for key in self._wanted]
+            return [(key, count) for key, count in missing if count > 0]
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'groups': len(self._pool),
+                    'prompts': sum(len(v) for v in self._pool.values())}
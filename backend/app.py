@@ -1,16 +1,34 @@
-from flask import Flask, jsonify, request, send_from_directory
+import time
+# 进程启动时刻，用于统计冷启动到首次成功响应的耗时
+PROCESS_START_TIME = time.time()
+from flask import Flask, jsonify, request, send_from_directory, redirect, url_for
 from weather.weather_qq_api import get_qq_weather
-from weather.get_location import get_location_by_ip
+from weather.weather_cache import WeatherCache
+from weather.location_cache import LocationCache
+from weather.get_location import get_location_by_ip, get_location_stats, init_ip_region_db
 from ai_image.ai_image_api import generate_image
 import os
+import re
+import math
+import hashlib
 import sys
 from flask_socketio import SocketIO, emit, disconnect
 import threading
-import time
 import io
 import logging
-from ai_image.make_prompt import make_draw_prompt, get_time_mood, get_weather_key
-from ai_image.ai_image_api import download_wallpaper
+from ai_image.make_prompt import make_draw_prompt, get_time_mood, get_weather_key, get_season, get_next_time_mood_boundary, \
+    init_prompt_pool, get_prompt_cache_stats
+from time_utils.scheduler import TimerScheduler
+from ai_image.llm_api import get_model_ranking, MODEL_ROUTER
+from ai_image.ai_image_api import download_wallpaper, remove_partial_downloads, CONTENT_HASH_LENGTH
+from wallpaper.job_queue import WallpaperJobQueue, PRIORITY_MANUAL, PRIORITY_SCHEDULED, STATUS_PROMPTING
+from wallpaper.library import WallpaperLibrary
+from wallpaper.disk_cache import WallpaperDiskCache
+from wallpaper.derivatives import WallpaperDerivatives, VARIANT_PRESETS, make_placeholder
+from wallpaper.prefetch import WallpaperPrefetcher
+from wallpaper.state_store import StateStore
+from net import http_client
+from monitoring import metrics, tracing
 import datetime
 # import gevent
 # print("gevent version:", gevent.__version__)
@@ -48,13 +66,35 @@ FRONTEND_LOCATION_CONFIG = {
     }
 }
 
-app = Flask(__name__, static_folder=os.path.join(BASE_DIR, 'static'))
+# 关闭 Flask 自带的静态路由，由 static_files() 统一处理缓存头
+app = Flask(__name__, static_folder=None)
 socketio = SocketIO(app, cors_allowed_origins='*', async_mode='gevent')
 app.config['WALLPAPER_DIR'] = STATIC_WALLPAPER_DIR
 
 DEFAULT_WALLPAPER = "default.jpg"
 DEFAULT_WALLPAPER_PATH = os.path.join(app.config['WALLPAPER_DIR'], DEFAULT_WALLPAPER)
 
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+# 上次运行中断时可能遗留未完成的下载
+remove_partial_downloads(STATIC_WALLPAPER_DIR)
+# 按生成条件索引的壁纸库
+LIBRARY = WallpaperLibrary(os.path.join(DATA_DIR, 'wallpaper_library.db'), STATIC_WALLPAPER_DIR)
+# 复用策略（见 wallpaper/library.py 的 DEFAULT_REUSE_POLICY），通过 /api/library-policy 修改并保存，
+# 也可以直接编辑 data/library_policy.json，重启后生效
+LIBRARY_POLICY_STORE = StateStore(os.path.join(DATA_DIR, 'library_policy.json'))
+try:
+    LIBRARY.set_policy(LIBRARY_POLICY_STORE.load())
+except ValueError as e:
+    logging.error(f"[library] 复用策略配置无效，使用默认策略: {e}")
+# 预先生成并持久化的提示词，生成壁纸时直接取用
+init_prompt_pool(os.path.join(DATA_DIR, 'prompt_pool.json'))
+
+# 实况天气缓存，/api/weather 和 update_cache() 共用
+WEATHER_CACHE = WeatherCache(get_qq_weather)
+# 可选的离线IP地区库，由 weather/ip_region_db.py 从 CSV 生成
+init_ip_region_db(os.path.join(DATA_DIR, 'ip_region.db'))
+# IP定位结果缓存，只在网络变化、休眠唤醒或公网IP变化时重新定位
+LOCATION_LOOKUP = LocationCache(get_location_by_ip)
 
 LOCATION_CACHE = {
     'province': "",
@@ -76,11 +116,52 @@ CACHE = {
     'weather_key': None,
     'time_mood': None,
     'prompt': None,
+    'filename': None,
     'province': '',
     'city': '',
     'county': ''
 }
 
+# 运行状态快照，启动时先用快照提供服务，再在后台刷新位置和天气
+STATE_STORE = StateStore(os.path.join(DATA_DIR, 'state.json'))
+STARTUP_STATS = {
+    'restored_from_snapshot': False,
+    'first_response_ms': None,
+    'cache_ready_ms': None
+}
+
+def save_state():
+    refresh_auto_wallpaper_state()
+    STATE_STORE.save({'cache': CACHE, 'location_cache': LOCATION_CACHE,
+                      'location_lookup': LOCATION_LOOKUP.snapshot(), 'saved_at': time.time()})
+
+def restore_state():
+    global LOCATION_CACHE
+    state = STATE_STORE.load()
+    if not state:
+        return False
+    for key, value in state.get('cache', {}).items():
+        if key in CACHE:
+            CACHE[key] = value
+    location = state.get('location_cache')
+    if isinstance(location, dict):
+        LOCATION_CACHE = {k: location.get(k, '') for k in ('province', 'city', 'county')}
+    LOCATION_LOOKUP.restore(state.get('location_lookup'))
+    # 快照中的时间段可能已过期，壁纸文件可能已被清理
+    CACHE['time_mood'] = get_time_mood()
+    if CACHE['filename'] and not os.path.exists(get_wallpaper_path(CACHE['filename'])):
+        CACHE['filename'] = None
+    logging.info(f"[startup] 已从快照恢复状态: {CACHE['province']}{CACHE['city']}{CACHE['county']}, {CACHE['filename']}")
+    return True
+
+# 壁纸目录磁盘配额，默认壁纸、当前壁纸和收藏不会被淘汰
+# 缩略图、预览图和各显示器分辨率的壁纸变体，首次请求时生成
+# 首次请求某个尺寸时最多等待几秒生成变体，用 socketio.sleep 等待，不阻塞其他请求
+DERIVATIVES = WallpaperDerivatives(LIBRARY, os.path.join(BASE_DIR, 'static', 'variants'), sleep=socketio.sleep)
+
+DISK_CACHE = WallpaperDiskCache(LIBRARY, pinned=lambda: {DEFAULT_WALLPAPER, CACHE['filename'], *PREFETCHER.pinned()},
+                                on_evict=DERIVATIVES.remove)
+
 # 记录上一次的时间段和天气
 last_time_mood = None
 last_weather = None
@@ -95,33 +176,214 @@ def get_wallpaper_filename_by_prompts(prompt: str) -> str:
     safe_filename = generate_safe_filename(prompt.strip(), max_length=80)
     return f"{safe_filename}.jpg"
 
+# 带内容哈希的文件名，如 xxx.<12位sha256>.jpg 或变体 xxx.<12位sha256>@960w.jpg
+CONTENT_HASH_NAME = re.compile(r'\.([0-9a-f]{%d}(?:@\d+w)?)\.(?:jpe?g|png|webp|gif)$' % CONTENT_HASH_LENGTH)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
 def get_wallpaper_path(filename) -> str:
     # filename = get_wallpaper_filename(time_mood, weather_key)
     # filename = get_wallpaper_filename_by_prompts(prompt)
     return os.path.join(app.config['WALLPAPER_DIR'], filename)
 
-def make_new_wallpaper(time_mood, weather_key, notify_frontend=True):
+# 壁纸目标分辨率
+WALLPAPER_SIZE = (1920, 1080)
+
+# 生成相关的指标，缓存命中率等在抓取时从各模块的 stats() 读取，见 collect_metrics
+MAKE_WALLPAPER_SECONDS = metrics.histogram('wallpaper_make_new_wallpaper_seconds', 'make_new_wallpaper 端到端耗时（秒）',
+                                           ('outcome',))
+DOWNLOAD_SECONDS = metrics.histogram('wallpaper_image_download_seconds', '壁纸下载耗时（秒），包含重试和校验',
+                                     ('outcome',))
+GENERATIONS = metrics.counter('wallpaper_generations_total', '壁纸生成任务数', ('trigger', 'outcome'))
+LLM_SECONDS = metrics.histogram('wallpaper_llm_request_seconds', '绘画提示词模型请求耗时（秒）', ('model',))
+LLM_REQUESTS = metrics.counter('wallpaper_llm_requests_total', '绘画提示词模型请求次数', ('model', 'outcome'))
+
+def observe_llm_call(model, elapsed_ms, outcome):
+    LLM_SECONDS.observe(elapsed_ms / 1000, model)
+    LLM_REQUESTS.inc(model, outcome)
+    tracing.record_span(f'llm:{model}', elapsed_ms / 1000, outcome=outcome)
+
+MODEL_ROUTER.on_record = observe_llm_call
+
+def make_new_wallpaper(time_mood, weather_key, notify_frontend=True, on_progress=None, allow_reuse=True,
+                       requested_at=None):
+    # 相同条件的重复提交已在 JOB_QUEUE.submit 中合并，见 generation_key
+    requested_at = requested_at or time.time()
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        with tracing.trace('make_new_wallpaper', time_mood=time_mood, weather_key=weather_key, allow_reuse=allow_reuse):
+            result = _make_new_wallpaper(time_mood, weather_key, notify_frontend, on_progress, allow_reuse, requested_at)
+        outcome = 'success' if result[0] else 'failure'
+    finally:
+        MAKE_WALLPAPER_SECONDS.observe(time.perf_counter() - start, outcome)
+    return result
+
+# 手动刷新和后台生成在不同通道并行执行，只有比当前壁纸更晚提交的任务才能切换壁纸，
+# 避免先开始的定时生成在手动刷新之后完成时把壁纸换回去
+SWITCH_LOCK = threading.Lock()
+CURRENT_REQUESTED_AT = 0.0
+
+def set_current_wallpaper(prompt, filename, time_mood, weather_key, notify_frontend, requested_at=None):
+    global CURRENT_REQUESTED_AT
+    requested_at = requested_at or time.time()
+    with SWITCH_LOCK:
+        if requested_at < CURRENT_REQUESTED_AT:
+            logging.info(f"[make_new_wallpaper] 已有更晚提交的任务切换了壁纸，不再切换到: {filename}")
+            return False
+        CURRENT_REQUESTED_AT = requested_at
+        CACHE['prompt'] = prompt
+        CACHE['filename'] = filename
+    LIBRARY.mark_shown(filename)
+    entry = LIBRARY.get(filename)
+    if entry is not None and not entry['placeholder']:
+        # 早期生成的壁纸没有占位图，第一次展示时补上
+        LIBRARY.set_placeholder(filename, make_placeholder(get_wallpaper_path(filename)))
+    save_state()
+    if notify_frontend:
+        # 推送完整的新状态和占位图，前端无需再请求 /api/auto-wallpaper
+        version, etag, _ = AUTO_WALLPAPER_STATE
+        socketio.emit('refresh_wallpaper', {**build_auto_wallpaper_payload(), 'weather_key': weather_key,
+                                            'version': version, 'etag': etag, 'emitted_at': time.time()})
+    return True
+
+def _make_new_wallpaper(time_mood, weather_key, notify_frontend, on_progress, allow_reuse, requested_at):
     global CACHE, last_time_mood, last_weather, last_trigger_time
     now = datetime.datetime.now()
     last_time_mood = time_mood
     last_weather = weather_key
     last_trigger_time = now.timestamp()
-    prompt = make_draw_prompt(time_mood, weather_key)
-    CACHE['prompt'] = prompt
+    season = get_season()
+    if allow_reuse:
+        # 优先使用提前生成好的壁纸
+        with tracing.span('prefetch_take'):
+            prepared = PREFETCHER.take(time_mood, weather_key)
+        if prepared is not None and LIBRARY.contains(prepared['filename']):
+            logging.info(f"[make_new_wallpaper] 使用预生成的壁纸: {prepared['filename']}")
+            tracing.annotate(source='prefetch', filename=prepared['filename'])
+            set_current_wallpaper(prepared['prompt'], prepared['filename'], time_mood, weather_key, notify_frontend,
+                                  requested_at)
+            return True, prepared['prompt'], prepared['filename']
+        with tracing.span('library_pick'):
+            entry = LIBRARY.pick(time_mood, weather_key, season, exclude=CACHE['filename'])
+        if entry is not None:
+            logging.info(f"[make_new_wallpaper] 复用壁纸库中的壁纸: {entry['filename']}")
+            tracing.annotate(source='library', filename=entry['filename'])
+            set_current_wallpaper(entry['prompt'], entry['filename'], time_mood, weather_key, notify_frontend, requested_at)
+            return True, entry['prompt'], entry['filename']
+    ret, prompt, filename = generate_wallpaper(time_mood, weather_key, season, on_progress, allow_cached_prompt=allow_reuse)
+    tracing.annotate(source='generated', filename=filename)
+    if ret:
+        set_current_wallpaper(prompt, filename, time_mood, weather_key, notify_frontend, requested_at)
+    return ret, prompt, filename
+
+def generate_wallpaper(time_mood, weather_key, season, on_progress=None, allow_cached_prompt=True):
+    """生成提示词并下载壁纸，登记到壁纸库，不切换当前壁纸"""
+    if on_progress:
+        on_progress(STATUS_PROMPTING)
+    with tracing.span('make_draw_prompt'):
+        prompt = make_draw_prompt(time_mood, weather_key, allow_cached=allow_cached_prompt,
+                                  recently_used=LIBRARY.prompt_recently_shown)
+    existing = LIBRARY.find_by_prompt(prompt)
+    if existing is not None and os.path.exists(get_wallpaper_path(existing['filename'])):
+        logging.info(f"[make_new_wallpaper] 已存在壁纸文件: {existing['filename']}")
+        return True, prompt, existing['filename']
+    # 最终文件名带内容哈希，下载完成后才能确定
     filename = get_wallpaper_filename_by_prompts(prompt)
     local_path = get_wallpaper_path(filename)
-    if os.path.exists(local_path):
-        logging.info(f"[make_new_wallpaper] 已存在壁纸文件: {local_path}")
-        if notify_frontend:
-            socketio.emit('refresh_wallpaper', {'time_mood': time_mood, 'weather': weather_key})
-        return True, prompt, filename
-    ret = download_wallpaper(prompt, local_path, max_retries=3)
-    if ret == True:
-        if notify_frontend:
-            socketio.emit('refresh_wallpaper', {'time_mood': time_mood, 'weather': weather_key})
+    width, height = WALLPAPER_SIZE
+    start = time.perf_counter()
+    with tracing.span('download_wallpaper'):
+        ret = download_wallpaper(prompt, local_path, max_retries=3, width=width, height=height,
+                                 on_progress=on_progress, content_addressed=True)
+        if ret:
+            tracing.annotate(bytes=ret['size'], format=ret['format'], width=ret['width'], height=ret['height'])
+    DOWNLOAD_SECONDS.observe(time.perf_counter() - start, 'success' if ret else 'failure')
+    if ret:
+        filename = ret['filename']
+        with tracing.span('make_placeholder'):
+            placeholder = make_placeholder(get_wallpaper_path(filename))
+        LIBRARY.add(filename, prompt, time_mood, weather_key, season,
+                    width=ret['width'], height=ret['height'], image_format=ret['format'], size=ret['size'],
+                    sha256=ret['sha256'], placeholder=placeholder)
+        DERIVATIVES.warm(filename)
+        DISK_CACHE.notify()
         return True, prompt, filename
     return False, prompt, filename
 
+def run_prefetch_job(job):
+    """预生成下一时间段的壁纸，只登记结果，不切换当前壁纸"""
+    time_mood = job.params['time_mood']
+    weather_key = job.params['weather_key']
+    season = job.params['season']
+    try:
+        with tracing.span('library_pick'):
+            entry = LIBRARY.pick(time_mood, weather_key, season, exclude=CACHE['filename'])
+        if entry is not None:
+            ret, prompt, filename = True, entry['prompt'], entry['filename']
+        else:
+            ret, prompt, filename = generate_wallpaper(time_mood, weather_key, season, job.report)
+    except Exception:
+        PREFETCHER.fail(job)
+        raise
+    if not ret:
+        PREFETCHER.fail(job)
+        raise Exception('预生成壁纸失败')
+    PREFETCHER.complete(job, prompt, filename)
+    return {'filename': filename, 'prompt': prompt, 'time_mood': time_mood, 'weather_key': weather_key}
+
+def run_wallpaper_job(job):
+    """任务队列的执行函数"""
+    outcome = 'failure'
+    try:
+        with tracing.trace('wallpaper_job', trigger=job.trigger, job_id=job.job_id):
+            result = _run_wallpaper_job(job)
+        outcome = 'success'
+        return result
+    finally:
+        GENERATIONS.inc(job.trigger, outcome)
+
+def _run_wallpaper_job(job):
+    if job.trigger == 'prefetch':
+        return run_prefetch_job(job)
+    if job.params.get('refresh_cache'):
+        with tracing.span('update_cache'):
+            update_cache()
+    time_mood = job.params.get('time_mood') or CACHE['time_mood']
+    weather_key = job.params.get('weather_key') or CACHE['weather_key']
+    logging.info(f"[wallpaper_job] 开始生成壁纸 {job.job_id} ({job.trigger}): {time_mood}, {weather_key}")
+    # 手动刷新总是生成新图，其余触发允许复用壁纸库
+    allow_reuse = job.trigger != 'manual'
+    ret, prompt, filename = make_new_wallpaper(time_mood, weather_key, on_progress=job.report, allow_reuse=allow_reuse,
+                                               requested_at=job.created_at)
+    if not ret:
+        raise Exception('壁纸生成失败，请稍后重试')
+    return {'filename': filename, 'prompt': prompt, 'time_mood': time_mood, 'weather_key': weather_key}
+
+def emit_job_update(job):
+    socketio.emit('wallpaper_job', job.to_dict())
+
+# 手动刷新和后台任务（定时生成、预生成）各有一个工作线程，点击刷新不用等后台任务完成
+JOB_QUEUE = WallpaperJobQueue(run_wallpaper_job, on_update=emit_job_update)
+# 在时间段切换前提前生成下一时间段的壁纸
+PREFETCHER = WallpaperPrefetcher(JOB_QUEUE)
+
+def generation_key(kind, time_mood, weather_key):
+    """
+    任务去重键，条件相同的任务正在排队或执行时，新的提交合并到该任务
+
+    手动刷新总是生成新图，与允许复用壁纸库的定时任务结果不同，用 kind 区分
+    """
+    return kind, time_mood, weather_key, WALLPAPER_SIZE
+
+def schedule_wallpaper(time_mood, weather_key, trigger, priority=PRIORITY_SCHEDULED):
+    """提交壁纸生成任务，并记录触发条件，避免下一轮检测重复触发"""
+    global last_time_mood, last_weather, last_trigger_time
+    last_time_mood = time_mood
+    last_weather = weather_key
+    last_trigger_time = datetime.datetime.now().timestamp()
+    return JOB_QUEUE.submit(priority, trigger, key=generation_key('scheduled', time_mood, weather_key),
+                            time_mood=time_mood, weather_key=weather_key)
+
 def get_location_config():
     """获取当前地理位置配置"""
     global FRONTEND_LOCATION_CONFIG
@@ -207,7 +469,7 @@ def weather():
     province = loc.get('province', '')
     city = loc.get('city', '')
     county = loc.get('county', '')
-    weather_data = get_qq_weather(province, city, county)
+    weather_data = WEATHER_CACHE.get(province, city, county)
     logging.info(f"[/api/weather] 获取天气成功: {province}, {city}, {county}, {weather_data}")
     # 返回风力、湿度、位置
     return jsonify({
@@ -222,9 +484,13 @@ def generate_ai_image():
     image_data = generate_image()
     return jsonify(image_data)
 
-@app.route('/api/auto-wallpaper', methods=['GET'])
-def auto_wallpaper():
-    # global CACHE
+# 长轮询最长等待时间和检查间隔（秒）
+LONG_POLL_MAX_WAIT = 60
+LONG_POLL_INTERVAL = 0.25
+# /api/auto-wallpaper 的当前响应 (版本号, ETag, JSON)，状态变化时整体替换
+AUTO_WALLPAPER_STATE = (0, None, None)
+
+def build_auto_wallpaper_payload():
     # 直接读取缓存
     weather_data = CACHE['weather_data'] or {}
     if 'error' in weather_data:
@@ -240,20 +506,15 @@ def auto_wallpaper():
     time_mood = CACHE['time_mood'] or get_time_mood()
     # weather_key = CACHE['weather_key'] or get_weather_key(weather)
     if CACHE['prompt'] is None:
-        # 如果缓存中没有prompt，则生成一个新的
         logging.info("[auto_wallpaper] CACHE中没有prompt")
         prompt = "None"
     else:
         prompt = CACHE['prompt']
-        logging.info(f"[auto_wallpaper] 使用缓存中的prompt: {prompt}")
-
-    # 文件名
-    filename = get_wallpaper_filename_by_prompts(prompt)
-    local_path = get_wallpaper_path(filename)
-
 
-    # 优先返回本地图片，否则返回默认图片
-    if os.path.exists(local_path):
+    # 当前壁纸直接查内存中的壁纸库索引，否则返回默认图片
+    filename = CACHE['filename']
+    entry = LIBRARY.get(filename) if filename else None
+    if entry is not None:
         local_url = f"/static/wallpapers/{filename}"
     elif os.path.exists(DEFAULT_WALLPAPER_PATH):
         logging.info(f"[auto_wallpaper] 使用默认壁纸: {DEFAULT_WALLPAPER}")
@@ -261,7 +522,7 @@ def auto_wallpaper():
     else:
         local_url = ""  # 没有任何图片
 
-    return jsonify({
+    return {
         'prompt': prompt,
         'image_url': local_url,
         'weather': weather,
@@ -271,38 +532,273 @@ def auto_wallpaper():
         'province': province,
         'city': city,
         'county': county,
-        'time_mood': time_mood
-    })
+        'time_mood': time_mood,
+        'sha256': entry['sha256'] if entry else None,
+        'width': entry['width'] if entry else None,
+        'height': entry['height'] if entry else None,
+        'format': entry['format'] if entry else None,
+        'placeholder': entry['placeholder'] if entry else None
+    }
+
+def refresh_auto_wallpaper_state():
+    """重新生成 /api/auto-wallpaper 的响应，内容变化时版本号加一，唤醒长轮询的请求"""
+    global AUTO_WALLPAPER_STATE
+    body = app.json.dumps(build_auto_wallpaper_payload())
+    etag = hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+    version, current_etag, _ = AUTO_WALLPAPER_STATE
+    if etag != current_etag:
+        AUTO_WALLPAPER_STATE = (version + 1, etag, body)
+        logging.info(f"[auto_wallpaper] 状态更新到版本 {version + 1}: {CACHE['prompt']}")
+
+@app.route('/api/auto-wallpaper', methods=['GET'])
+def auto_wallpaper():
+    """
+    当前壁纸和天气
+
+    响应带 ETag，If-None-Match 匹配时返回 304。
+    带 wait=秒数 参数且 If-None-Match 与当前版本一致时为长轮询：
+    等到状态变化后返回新内容，超时仍未变化返回 304。
+    """
+    state = AUTO_WALLPAPER_STATE
+    wait = min(max(request.args.get('wait', 0, type=float), 0), LONG_POLL_MAX_WAIT)
+    if wait and request.if_none_match.contains(state[1]):
+        deadline = time.time() + wait
+        # socketio.sleep 在 gevent 下让出执行权，等待期间不阻塞其他请求
+        while AUTO_WALLPAPER_STATE is state and time.time() < deadline:
+            socketio.sleep(LONG_POLL_INTERVAL)
+        state = AUTO_WALLPAPER_STATE
+    version, etag, body = state
+
+    if STARTUP_STATS['first_response_ms'] is None:
+        STARTUP_STATS['first_response_ms'] = round((time.time() - PROCESS_START_TIME) * 1000)
+        logging.info(f"[startup] 启动后首次响应 /api/auto-wallpaper 耗时: {STARTUP_STATS['first_response_ms']} ms")
+
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['X-State-Version'] = str(version)
+    resp.cache_control.no_cache = True
+    return resp
 
 @app.route('/api/refresh-wallpaper', methods=['POST'])
 def refresh_wallpaper():
-    """强制生成新壁纸"""
-    global CACHE
+    """强制生成新壁纸，立即返回任务ID，进度通过 wallpaper_job 事件推送"""
     try:
-        update_cache()
-        time_mood = CACHE['time_mood']
-        weather_key = CACHE['weather_key']
-        logging.info(f"[refresh_wallpaper] 手动生成新壁纸: {time_mood}, {weather_key}")
-        ret, prompt, filename = make_new_wallpaper(time_mood, weather_key, notify_frontend=False)
-        if ret == True:
-            logging.info(f"[refresh_wallpaper] 新壁纸生成成功: {filename}")
-            return jsonify({
-                'success': True,
-                'message': '新壁纸生成成功',
-                'filename': filename,
-                'prompt': prompt
-            })
-        else:
-            logging.error(f"[refresh_wallpaper] 新壁纸生成失败")
-            return jsonify({'success': False, 'error': '壁纸生成失败，请稍后重试'}), 500
+        # 连续点击时合并到正在排队或生成中的手动任务
+        job = JOB_QUEUE.submit(PRIORITY_MANUAL, 'manual', refresh_cache=True,
+                               key=generation_key('manual', CACHE['time_mood'], CACHE['weather_key']))
+        logging.info(f"[refresh_wallpaper] 手动生成新壁纸任务已提交: {job.job_id}")
+        return jsonify({
+            'success': True,
+            'message': '壁纸生成任务已提交',
+            'job_id': job.job_id,
+            'status': job.status
+        }), 202
 
     except Exception as e:
         logging.error(f"refresh_wallpaper error: {e}")
         return jsonify({'success': False,'error': str(e)}), 500
 
+@app.route('/api/wallpaper-jobs', methods=['GET'])
+def list_wallpaper_jobs():
+    """列出最近的壁纸生成任务"""
+    return jsonify({
+        'pending': JOB_QUEUE.pending_count(),
+        'jobs': [job.to_dict() for job in JOB_QUEUE.list_jobs()]
+    })
+
+@app.route('/api/wallpaper-jobs/<job_id>', methods=['GET'])
+def get_wallpaper_job(job_id):
+    """查询壁纸生成任务状态"""
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/llm-models', methods=['GET'])
+def llm_models():
+    """绘画提示词模型的动态排名"""
+    return jsonify({'models': get_model_ranking()})
+
+@app.route('/api/generation-stats', methods=['GET'])
+def generation_stats():
+    """并发生成合并统计"""
+    return jsonify({
+        'job_queue': JOB_QUEUE.stats(),
+        'library': LIBRARY.stats(),
+        'disk_cache': DISK_CACHE.stats(),
+        'derivatives': DERIVATIVES.stats(),
+        'prefetch': PREFETCHER.stats(),
+        'scheduler': SCHEDULER.stats(),
+        'startup': STARTUP_STATS,
+        'http': http_client.stats(),
+        'location': get_location_stats(),
+        'location_cache': LOCATION_LOOKUP.stats(),
+        'weather': WEATHER_CACHE.stats(),
+        'prompt': get_prompt_cache_stats()
+    })
+
+def collect_metrics():
+    """抓取时读取各模块已有的统计，转换成指标"""
+    weather = WEATHER_CACHE.stats()
+    location = LOCATION_LOOKUP.stats()
+    prompt = get_prompt_cache_stats()
+    pool = prompt['pool'] or {}
+    derivatives = DERIVATIVES.stats()
+    prefetch = PREFETCHER.stats()
+    cache_requests = [
+        ({'cache': 'weather', 'result': 'hit'}, weather['hits']),
+        ({'cache': 'weather', 'result': 'stale_hit'}, weather['stale_hits']),
+        ({'cache': 'weather', 'result': 'error_hit'}, weather['error_hits']),
+        ({'cache': 'weather', 'result': 'miss'}, weather['misses']),
+        ({'cache': 'location', 'result': 'hit'}, location['avoided']),
+        ({'cache': 'location', 'result': 'miss'}, location['calls'] - location['avoided']),
+        ({'cache': 'prompt', 'result': 'hit'}, prompt['cache']['hits']),
+        ({'cache': 'prompt', 'result': 'miss'}, prompt['cache']['misses']),
+        ({'cache': 'prompt_pool', 'result': 'hit'}, pool.get('hits')),
+        ({'cache': 'prompt_pool', 'result': 'miss'}, pool.get('misses')),
+        ({'cache': 'variant', 'result': 'hit'}, derivatives['hits']),
+        ({'cache': 'variant', 'result': 'miss'}, derivatives['originals'] + derivatives['pending']),
+        ({'cache': 'prefetch', 'result': 'hit'}, prefetch['hits']),
+        ({'cache': 'prefetch', 'result': 'miss'}, prefetch['misses'])
+    ]
+    jobs = JOB_QUEUE.stats()
+    library = LIBRARY.stats()
+    return [
+        ('wallpaper_cache_requests_total', 'counter', '各缓存的命中和未命中次数', cache_requests),
+        ('wallpaper_jobs_coalesced_total', 'counter', '合并到排队中或执行中任务的提交次数', [({}, jobs['coalesced'])]),
+        ('wallpaper_socketio_connected_clients', 'gauge', '已连接的前端客户端数', [({}, connected_clients)]),
+        ('wallpaper_job_queue_pending', 'gauge', '等待执行的壁纸生成任务数', [({}, jobs['pending'])]),
+        ('wallpaper_library_wallpapers', 'gauge', '壁纸库中的壁纸数', [({}, library['total'])]),
+        ('wallpaper_library_bytes', 'gauge', '壁纸库占用的磁盘空间（字节）', [({}, library['total_bytes'])]),
+        ('wallpaper_uptime_seconds', 'gauge', '进程运行时间（秒）', [({}, round(time.time() - PROCESS_START_TIME, 1))])
+    ]
+
+metrics.register_collector(collect_metrics)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 文本格式的指标"""
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/debug/traces', methods=['GET'])
+def list_traces():
+    """
+    最近的壁纸生成追踪摘要
+
+    参数: limit；format=chrome 时导出全部追踪的 Chrome trace-event JSON
+    """
+    if request.args.get('format') == 'chrome':
+        return jsonify(tracing.chrome_trace())
+    return jsonify({'traces': tracing.recent(request.args.get('limit', type=int))})
+
+@app.route('/api/debug/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """单次追踪的 span 树，format=chrome 时导出 Chrome trace-event JSON"""
+    trace = tracing.get(trace_id)
+    if trace is None:
+        return jsonify({'error': '追踪不存在'}), 404
+    if request.args.get('format') == 'chrome':
+        return jsonify(tracing.chrome_trace({trace_id}))
+    return jsonify(trace)
+
+@app.route('/api/wallpapers/<path:filename>/favorite', methods=['POST', 'DELETE'])
+def favorite_wallpaper(filename):
+    """收藏/取消收藏壁纸，收藏的壁纸不会被磁盘清理淘汰"""
+    if not LIBRARY.set_favorite(filename, request.method == 'POST'):
+        return jsonify({'error': '壁纸不存在'}), 404
+    return jsonify({'success': True, 'filename': filename, 'favorite': request.method == 'POST'})
+
+@app.route('/api/library-policy', methods=['GET', 'POST'])
+def library_policy():
+    """壁纸复用策略，POST 只修改传入的字段: enabled, min_pool_size, min_repeat_interval, reuse_probability"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': '请求数据应为对象'}), 400
+        try:
+            policy = LIBRARY.set_policy(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        LIBRARY_POLICY_STORE.save(policy)
+        logging.info(f"[library] 复用策略已更新: {policy}")
+    return jsonify(LIBRARY.policy)
+
+def positive_float_arg(name):
+    """读取正数查询参数，未提供时返回 None，格式不对时抛出 ValueError"""
+    raw = request.args.get(name)
+    if raw is None:
+        return None
+    try:
+        value = float(raw)
+    except ValueError:
+        raise ValueError(f'参数 {name} 应为正数: {raw}')
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(f'参数 {name} 应为正数: {raw}')
+    return value
+
+@app.route('/api/wallpapers/<path:filename>/variant', methods=['GET'])
+def wallpaper_variant(filename):
+    """
+    按显示尺寸选择最合适的壁纸文件，重定向到它带内容哈希的 /static 地址
+
+    选择结果会随变体生成、显示器登记而变化，重定向本身不缓存；目标文件名带内容哈希，
+    由 static_files 按不可变资源长期缓存
+    参数: preset=thumb|preview，或 w/h（CSS 像素）和 dpr
+    """
+    if not LIBRARY.contains(filename):
+        return jsonify({'error': '壁纸不存在'}), 404
+    preset = request.args.get('preset')
+    if preset is not None and preset not in VARIANT_PRESETS:
+        return jsonify({'error': f'未知的预设: {preset}'}), 400
+    try:
+        width = positive_float_arg('w')
+        height = positive_float_arg('h')
+        dpr = positive_float_arg('dpr')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    dpr = min(max(dpr or 1.0, 0.5), 4.0)
+    directory, name, variant_width = DERIVATIVES.resolve(filename, width, height, dpr, preset)
+    static_path = os.path.relpath(os.path.join(directory, name), os.path.join(BASE_DIR, 'static')).replace(os.sep, '/')
+    resp = redirect(url_for('static_files', filename=static_path))
+    resp.headers['X-Wallpaper-Variant'] = f"{variant_width}w" if variant_width else 'original'
+    resp.cache_control.no_cache = True
+    return resp
+
+@app.route('/api/displays', methods=['GET', 'POST'])
+def displays():
+    """前端登记当前连接的显示器: [{"width", "dpr"}]，width 为 CSS 像素"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return jsonify({'error': '请求数据应为显示器列表'}), 400
+        for display in data:
+            try:
+                DERIVATIVES.register_display(float(display['width']), float(display.get('dpr', 1.0)))
+            except (KeyError, TypeError, ValueError):
+                return jsonify({'error': f'显示器参数错误: {display}'}), 400
+        # 新登记的显示器宽度，为当前壁纸补生成变体
+        if CACHE['filename']:
+            DERIVATIVES.warm(CACHE['filename'])
+    return jsonify({'displays': DERIVATIVES.displays()})
+
 @app.route('/static/<path:filename>')
 def static_files(filename):
-    return send_from_directory(os.path.join(BASE_DIR, 'static'), filename)
+    """
+    静态文件，文件名带内容哈希（壁纸及其变体）的按不可变资源长期缓存，ETag 即内容哈希；
+    其他文件每次向服务端验证，未修改时返回 304。Range 请求由 send_from_directory 处理
+    """
+    match = CONTENT_HASH_NAME.search(filename)
+    if match:
+        resp = send_from_directory(os.path.join(BASE_DIR, 'static'), filename, etag=match.group(1), max_age=IMMUTABLE_MAX_AGE)
+        resp.cache_control.public = True
+        resp.cache_control.immutable = True
+    else:
+        resp = send_from_directory(os.path.join(BASE_DIR, 'static'), filename, max_age=0)
+        resp.cache_control.no_cache = True
+    return resp
 
 def update_cache():
     global LOCATION_CACHE
@@ -312,8 +808,8 @@ def update_cache():
     location_config = get_location_config()
 
     if location_config['auto_location']:
-        # 自动获取位置（通过IP）
-        ret_location = get_location_by_ip()
+        # 自动获取位置（通过IP），位置未变化时直接使用缓存
+        ret_location = LOCATION_LOOKUP.get()
         if 'error' in ret_location:
             logging.error(f"[location] 自动获取位置失败: {ret_location['error']}")
             # 当自动获取位置失败 且LOCATION_CACHE中没有缓存时，才使用手动设置的位置
@@ -336,7 +832,7 @@ def update_cache():
         else:
             logging.warning(f"[location] 手动位置为空，尝试自动获取")
             # 如果手动位置为空，仍然尝试自动获取
-            ret_location = get_location_by_ip()
+            ret_location = LOCATION_LOOKUP.get()
             if 'error' not in ret_location:
                 LOCATION_CACHE = ret_location
                 logging.info(f"[location] 备用自动获取位置成功: {ret_location}")
@@ -345,7 +841,7 @@ def update_cache():
     province = loc.get('province', '')
     city = loc.get('city', '')
     county = loc.get('county', '')
-    weather_data = get_qq_weather(province, city, county)
+    weather_data = WEATHER_CACHE.get(province, city, county)
     if 'error' in weather_data:
         logging.error(f"[weather] 获取天气失败: {weather_data['error']}")
         # 保持上一次的weather_data不变，或用默认值
@@ -366,71 +862,140 @@ def update_cache():
     CACHE['province'] = province
     CACHE['city'] = city
     CACHE['county'] = county
+    save_state()
 
-update_cache()
+def warm_up_cache():
+    """后台预热上游连接并刷新位置和天气，不阻塞服务启动"""
+    try:
+        http_client.warm_up()
+        update_cache()
+        STARTUP_STATS['cache_ready_ms'] = round((time.time() - PROCESS_START_TIME) * 1000)
+        logging.info(f"[startup] 位置和天气刷新完成，耗时: {STARTUP_STATS['cache_ready_ms']} ms")
+    except Exception as e:
+        logging.error(f"[startup] 刷新位置和天气失败: {e}")
+
+STARTUP_STATS['restored_from_snapshot'] = restore_state()
+refresh_auto_wallpaper_state()
+threading.Thread(target=warm_up_cache, daemon=True).start()
 
-# 改为记录连接的客户端数量
+# 已发送 ready_for_push 的客户端（按 sid 记录，重复发送或未就绪就断开的连接不会让计数偏离）
+PUSH_CLIENTS = set()
 connected_clients = 0
 enabled_push = threading.Event()
 
 @socketio.on('ready_for_push')
 def handle_ready_for_push():
     global connected_clients
-    connected_clients += 1
+    PUSH_CLIENTS.add(request.sid)
+    connected_clients = len(PUSH_CLIENTS)
+    was_enabled = enabled_push.is_set()
     enabled_push.set()
+    if not was_enabled:
+        # 所有客户端断开期间跳过了检测，重新连接后立即检查一次
+        SCHEDULER.trigger('weather_poll')
+        SCHEDULER.trigger('time_mood_boundary')
     logging.info(f"[socketio] 前端客户端 已准备好接收推送 (当前客户端数: {connected_clients})")
 
 @socketio.on('disconnect')
 def handle_disconnect():
     global connected_clients
-    connected_clients = max(0, connected_clients - 1)
+    PUSH_CLIENTS.discard(request.sid)
+    connected_clients = len(PUSH_CLIENTS)
     if connected_clients == 0:
         enabled_push.clear()
     logging.info(f"[socketio] 客户端断开 (剩余客户端数: {connected_clients})")
 
-def wallpaper_monitor():
-    global CACHE, last_time_mood, last_weather, last_trigger_time
-    check_interval = 60  # 检查间隔时间（秒）
-    try:
-        while True:
-            if not enabled_push.is_set():
-                logging.info('[wallpaper_monitor] 等待前端ready_for_push...')
-                enabled_push.wait()
-            try:
-                update_cache()
-            except Exception as e:
-                logging.error(f'[wallpaper_monitor] 更新缓存失败: {e}')
-                time.sleep(10)
-                continue
-            logging.info("[wallpaper_monitor] 壁纸更新监控线程运行中...")
-            time_mood = CACHE['time_mood']
-            weather_key = CACHE['weather_key']
-
-            now = datetime.datetime.now()
-            is_on_the_hour = (now.minute == 0)
-            now_ts = now.timestamp()
-            # 距离上次触发超过10分钟才允许整点触发
-            allow_on_the_hour = is_on_the_hour and (now_ts - last_trigger_time > 600)
-
-            # 检测到条件变化或首次启动时生成，或整点强制触发（需10分钟间隔）
-            if time_mood != last_time_mood:
-                logging.info(f"检测到时间变化: {last_time_mood} -> {time_mood}")
-                make_new_wallpaper(time_mood, weather_key)
-            if weather_key != last_weather:
-                logging.info(f"检测到天气变化: {last_weather} -> {weather_key}")
-                make_new_wallpaper(time_mood, weather_key)
-            if allow_on_the_hour:
-                logging.info(f"整点触发壁纸更新: {now}")
-                make_new_wallpaper(time_mood, weather_key)
-
-            time.sleep(check_interval)  # 每分钟检测一次
-    except Exception as e:
-        import traceback
-        logging.error("[wallpaper_monitor] 未捕获异常:", e)
-        traceback.print_exc()
-        # 可选：通知主线程或重启
+# 各类定时任务的节奏
+WEATHER_POLL_INTERVAL = 5 * 60   # 位置和天气刷新间隔（秒）
+HOURLY_MIN_GAP = 600             # 距离上次触发超过10分钟才允许整点触发
+
+SCHEDULER = TimerScheduler()
+
+def next_weather_poll(now_ts):
+    return now_ts + WEATHER_POLL_INTERVAL
+
+def next_time_mood_boundary(now_ts):
+    boundary, _ = get_next_time_mood_boundary(datetime.datetime.fromtimestamp(now_ts))
+    return boundary.timestamp()
+
+def next_prefetch(now_ts):
+    # 在下一个时间段切换前 lead_time 秒执行预生成检查
+    boundary_ts = next_time_mood_boundary(now_ts)
+    if boundary_ts - PREFETCHER.lead_time > now_ts:
+        return boundary_ts - PREFETCHER.lead_time
+    # 已进入提前量窗口，等本次切换之后再计算下一次
+    return next_prefetch(boundary_ts)
+
+def next_hour(now_ts):
+    now = datetime.datetime.fromtimestamp(now_ts)
+    return (now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)).timestamp()
+
+def poll_weather():
+    """刷新位置和天气，天气变化时生成新壁纸"""
+    if not enabled_push.is_set():
+        return
+    update_cache()
+    weather_key = CACHE['weather_key']
+    if weather_key != last_weather:
+        logging.info(f"检测到天气变化: {last_weather} -> {weather_key}")
+        schedule_wallpaper(CACHE['time_mood'], weather_key, 'weather_change')
+
+def on_time_mood_boundary():
+    """时间段切换，优先使用预生成的壁纸"""
+    time_mood = get_time_mood()
+    if CACHE['time_mood'] != time_mood:
+        CACHE['time_mood'] = time_mood
+        # 更新 /api/auto-wallpaper 的响应和 ETag，唤醒长轮询的请求
+        save_state()
+    if not enabled_push.is_set():
+        return
+    if time_mood != last_time_mood:
+        logging.info(f"检测到时间变化: {last_time_mood} -> {time_mood}")
+        schedule_wallpaper(time_mood, CACHE['weather_key'], 'time_change')
+
+def on_hourly():
+    """整点强制触发，与时间段切换同时到期时排在其后执行"""
+    if not enabled_push.is_set():
+        return
+    if time.time() - last_trigger_time > HOURLY_MIN_GAP:
+        logging.info(f"整点触发壁纸更新: {datetime.datetime.now()}")
+        # 不用 CACHE 中的时间段：整点恰好是时间段切换时，CACHE 可能还是刚结束的时间段
+        schedule_wallpaper(get_time_mood(), CACHE['weather_key'], 'hourly')
+
+def on_prefetch():
+    """临近时间段切换时提前生成下一时间段的壁纸"""
+    if not enabled_push.is_set():
+        return
+    PREFETCHER.plan(CACHE['weather_key'])
 
-# 启动监控线程
+def wallpaper_monitor():
+    """等待前端就绪后生成首张壁纸，然后交给定时调度器按各自节奏触发"""
+    logging.info('[wallpaper_monitor] 等待前端ready_for_push...')
+    enabled_push.wait()
+    while True:
+        try:
+            update_cache()
+            break
+        except Exception as e:
+            logging.error(f'[wallpaper_monitor] 更新缓存失败: {e}')
+            time.sleep(10)
+    # 首次启动时生成
+    schedule_wallpaper(CACHE['time_mood'], CACHE['weather_key'], 'time_change')
+
+    now_ts = time.time()
+    # 时间段切换和整点可能同一时刻到期：先切换时间段，整点触发再按距上次触发的间隔决定是否跳过
+    SCHEDULER.add('weather_poll', poll_weather, next_weather_poll)
+    SCHEDULER.add('time_mood_boundary', on_time_mood_boundary, next_time_mood_boundary, order=0)
+    SCHEDULER.add('prefetch', on_prefetch, next_prefetch,
+                  first_run=now_ts if next_time_mood_boundary(now_ts) - now_ts <= PREFETCHER.lead_time else None)
+    SCHEDULER.add('hourly', on_hourly, next_hour, order=1)
+    SCHEDULER.run_forever()
+
+# 启动壁纸生成任务队列和监控线程
+JOB_QUEUE.start()
+LIBRARY.start()
+DISK_CACHE.start()
+LOCATION_LOOKUP.start()
 threading.Thread(target=wallpaper_monitor, daemon=True).start()
 
 if __name__ == '__main__':
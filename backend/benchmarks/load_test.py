@@ -0,0 +1,302 @@
+"""
+HTTP 接口和 Socket.IO 推送的压测
+
+默认把后端复制到临时目录，连接 stub_servers 中的上游替身，以 `python app.py --port` 的方式启动
+真实的 gevent 服务（也可以用 --url 压测已经运行的服务）。依次执行:
+
+1. 建立 --clients 个 Socket.IO 连接并发送 ready_for_push，记录服务进程内存的增量
+2. 在连接保持期间并发请求 /api/auto-wallpaper、/api/weather 和当前壁纸的 /static 文件
+3. 触发 --broadcasts 次手动刷新，统计 refresh_wallpaper 从发出到各客户端收到的延迟
+4. 多轮断开重连，并混入只连接不发送 ready_for_push 的客户端，检查服务端
+   connected_clients（/api/metrics 中的 wallpaper_socketio_connected_clients）是否与实际一致
+
+    python load_test.py --clients 50 --http-workers 16 --duration 20
+"""
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+try:
+    import socketio
+except ImportError:
+    socketio = None
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from offline_bench import LatencyRecorder, RESULTS_DIR, prepare_sandbox, _git_commit
+from stub_servers import StubUpstreams
+
+CONNECTED_CLIENTS_METRIC = re.compile(r'^wallpaper_socketio_connected_clients (\d+)', re.M)
+SERVER_START_TIMEOUT = 60
+EVENT_TIMEOUT = 60
+# 断开和连接后等待服务端处理完的时间
+SETTLE_SECONDS = 1.0
+
+
+def rss_bytes(pid):
+    """进程常驻内存，优先使用 psutil，否则读取 /proc，都不可用时返回 None"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def read_connected_clients(base_url):
+    resp = requests.get(f'{base_url}/api/metrics', timeout=10)
+    match = CONNECTED_CLIENTS_METRIC.search(resp.text)
+    return int(match.group(1)) if match else None
+
+
+class PushClient:
+    """模拟一个前端窗口：连接后发送 ready_for_push，记录收到 refresh_wallpaper 的延迟"""
+
+    def __init__(self, base_url, recorder):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.sio = socketio.Client(reconnection=False)
+        self.received = threading.Event()
+        self.sio.on('refresh_wallpaper', self._on_refresh)
+
+    def _on_refresh(self, data):
+        emitted_at = data.get('emitted_at') if isinstance(data, dict) else None
+        if emitted_at is not None:
+            self.recorder.record('refresh_wallpaper_delivery', max(0.0, time.time() - emitted_at))
+        self.received.set()
+
+    def connect(self, ready=True):
+        start = time.perf_counter()
+        self.sio.connect(self.base_url, wait_timeout=10)
+        self.recorder.record('socketio_connect', time.perf_counter() - start)
+        if ready:
+            self.sio.emit('ready_for_push')
+
+    @property
+    def connected(self):
+        return self.sio.connected
+
+    def disconnect(self):
+        if self.sio.connected:
+            self.sio.disconnect()
+
+
+def start_server(port, stubs, verbose):
+    """在临时目录中启动后端，返回 (进程, 临时目录)"""
+    tmp = tempfile.TemporaryDirectory(prefix='wallpaper-load-')
+    sandbox = os.path.join(tmp.name, 'backend')
+    prepare_sandbox(sandbox)
+    env = dict(os.environ, WALLPAPER_UPSTREAM_OVERRIDES=stubs.env_value())
+    log = None if verbose else open(os.path.join(tmp.name, 'server.log'), 'w', encoding='utf-8')
+    proc = subprocess.Popen([sys.executable, 'app.py', '--port', str(port)], cwd=sandbox, env=env,
+                            stdout=log, stderr=subprocess.STDOUT if log else None)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"后端启动失败，退出码 {proc.returncode}，日志: {tmp.name}")
+        try:
+            if requests.get(f'{base_url}/api/version', timeout=1).status_code == 200:
+                return proc, tmp
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError('等待后端启动超时')
+
+
+def connect_clients(base_url, recorder, count, ready=True):
+    clients = [PushClient(base_url, recorder) for _ in range(count)]
+    threads = [threading.Thread(target=client.connect, args=(ready,), daemon=True) for client in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    return [client for client in clients if client.connected]
+
+
+def run_http_load(base_url, recorder, workers, duration):
+    """多个线程在 duration 秒内循环请求各接口，每个线程一个 keep-alive 会话"""
+    image_url = requests.get(f'{base_url}/api/auto-wallpaper', timeout=10).json().get('image_url') or ''
+    routes = [('auto_wallpaper', '/api/auto-wallpaper'), ('weather', '/api/weather')]
+    if image_url.startswith('/static/'):
+        routes.append(('static_wallpaper', image_url))
+    deadline = time.time() + duration
+
+    def _worker():
+        session = requests.Session()
+        while time.time() < deadline:
+            name, path = random.choice(routes)
+            start = time.perf_counter()
+            try:
+                resp = session.get(base_url + path, timeout=30)
+                ok = resp.status_code < 400
+                resp.content
+            except requests.RequestException:
+                ok = False
+            recorder.record(f'http_{name}', time.perf_counter() - start, ok)
+
+    threads = [threading.Thread(target=_worker, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(duration + 60)
+
+
+def run_broadcasts(base_url, clients, recorder, count):
+    """触发手动刷新，等待所有客户端收到 refresh_wallpaper"""
+    missed = 0
+    for _ in range(count):
+        for client in clients:
+            client.received.clear()
+        start = time.perf_counter()
+        requests.post(f'{base_url}/api/refresh-wallpaper', timeout=10)
+        deadline = time.time() + EVENT_TIMEOUT
+        round_missed = sum(not client.received.wait(max(0.0, deadline - time.time())) for client in clients)
+        missed += round_missed
+        recorder.record('refresh_to_all_clients', time.perf_counter() - start, round_missed == 0)
+    return missed
+
+
+def check_drift(base_url, expected, label, checks):
+    time.sleep(SETTLE_SECONDS)
+    observed = read_connected_clients(base_url)
+    checks.append({'checkpoint': label, 'expected': expected, 'observed': observed,
+                   'drift': None if observed is None else observed - expected})
+    logging.info(f"[load] {label}: 实际 {expected} 个客户端，服务端计数 {observed}")
+
+
+def run_churn(base_url, clients, recorder, rounds, checks):
+    """断开并重连一部分客户端，同时混入不发送 ready_for_push 就断开的连接"""
+    for i in range(rounds):
+        leaving = random.sample(clients, len(clients) // 2)
+        for client in leaving:
+            client.disconnect()
+        clients = [client for client in clients if client not in leaving]
+        # 例如页面加载到一半就关闭的窗口
+        bare = connect_clients(base_url, recorder, max(1, len(leaving) // 4), ready=False)
+        time.sleep(SETTLE_SECONDS / 2)
+        for client in bare:
+            client.disconnect()
+        clients += connect_clients(base_url, recorder, len(leaving))
+        check_drift(base_url, len(clients), f'churn_round_{i + 1}', checks)
+    return clients
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='HTTP 接口和 Socket.IO 推送压测')
+    parser.add_argument('--url', help='压测已经运行的后端，不指定时自动启动')
+    parser.add_argument('--port', type=int, default=9100, help='自动启动后端时使用的端口')
+    parser.add_argument('--clients', type=int, default=20, help='Socket.IO 客户端数')
+    parser.add_argument('--http-workers', type=int, default=8, help='HTTP 并发数')
+    parser.add_argument('--duration', type=float, default=10, help='HTTP 压测时长（秒）')
+    parser.add_argument('--broadcasts', type=int, default=3, help='触发 refresh_wallpaper 的次数')
+    parser.add_argument('--churn-rounds', type=int, default=3, help='断开重连的轮数')
+    parser.add_argument('--latency', type=float, default=0.05, help='上游替身的延迟（秒）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='结果文件，默认 results/load-<时间>.json')
+    parser.add_argument('--verbose', action='store_true', help='显示后端日志')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if socketio is None:
+        parser.error('需要 python-socketio 客户端（随 flask-socketio 安装）')
+    random.seed(args.seed)
+
+    recorder = LatencyRecorder()
+    stubs = proc = tmp = None
+    base_url = args.url
+    if base_url is None:
+        stubs = StubUpstreams({'latency': args.latency}).start()
+        proc, tmp = start_server(args.port, stubs, args.verbose)
+        base_url = f'http://127.0.0.1:{args.port}'
+    pid = proc.pid if proc else None
+
+    checks = []
+    clients = []
+    try:
+        check_drift(base_url, 0, 'before_connect', checks)
+        rss_before = rss_bytes(pid) if pid else None
+        clients = connect_clients(base_url, recorder, args.clients)
+        check_drift(base_url, len(clients), 'after_connect', checks)
+        rss_after = rss_bytes(pid) if pid else None
+        # 首个 ready_for_push 会触发首张壁纸的生成，等它推送完再开始计时
+        time.sleep(SETTLE_SECONDS * 3)
+        transport = clients[0].sio.transport() if clients else None
+
+        logging.info(f"[load] HTTP 压测 {args.duration}s，并发 {args.http_workers}，保持 {len(clients)} 个推送连接")
+        run_http_load(base_url, recorder, args.http_workers, args.duration)
+        logging.info(f"[load] 触发 {args.broadcasts} 次 refresh_wallpaper 推送")
+        missed = run_broadcasts(base_url, clients, recorder, args.broadcasts)
+        clients = run_churn(base_url, clients, recorder, args.churn_rounds, checks)
+        for client in clients:
+            client.disconnect()
+        check_drift(base_url, 0, 'after_disconnect_all', checks)
+    finally:
+        for client in clients:
+            client.disconnect()
+        if proc is not None:
+            proc.terminate()
+            proc.wait(10)
+        if stubs is not None:
+            stubs.stop()
+        if tmp is not None:
+            tmp.cleanup()
+
+    drifted = [check for check in checks if check['drift']]
+    results = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': {k: v for k, v in vars(args).items() if k not in ('out', 'verbose')},
+            'transport': transport
+        },
+        'ops': recorder.summary(),
+        'memory': {
+            'rss_before_bytes': rss_before,
+            'rss_after_bytes': rss_after,
+            'per_connection_bytes': round((rss_after - rss_before) / len(clients)) if rss_before and rss_after and clients else None
+        },
+        'missed_events': missed,
+        'connected_clients_checks': checks,
+        'drift_detected': bool(drifted)
+    }
+    out = args.out or os.path.join(RESULTS_DIR, 'load-' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"\n传输方式: {transport}")
+    for op, stats in results['ops'].items():
+        print(f"  {op:<30} n={stats['count']:<6} err={stats['errors']:<4} p50={stats['p50_ms']:>9.1f}ms "
+              f"p99={stats['p99_ms']:>9.1f}ms rps={stats['throughput_per_s']}")
+    memory = results['memory']
+    if memory['per_connection_bytes'] is not None:
+        print(f"  每个连接的内存: {memory['per_connection_bytes'] / 1024:.1f} KB")
+    print(f"  未收到的推送: {missed}")
+    for check in drifted:
+        print(f"  connected_clients 偏差: {check['checkpoint']} 实际 {check['expected']}，服务端 {check['observed']}")
+    print(f"\n结果已保存到 {out}")
+    if drifted or missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
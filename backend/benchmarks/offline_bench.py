@@ -0,0 +1,344 @@
+"""
+离线基准测试
+
+把后端代码复制到临时目录，每个场景在独立的子进程中运行：先启动 stub_servers 中的上游替身，
+通过 WALLPAPER_UPSTREAM_OVERRIDES 让后端请求替身，再导入 app 并用 Flask test client 驱动。
+不需要网络，也不会改动 backend/data 和 backend/static 中的真实数据。
+
+场景:
+    cold_start    导入 app、首次响应、首次获取天气、首张壁纸的耗时
+    steady_state  定时检测循环（刷新位置和天气、检查时间段）以及前端轮询的接口
+    burst         同时提交多个手动刷新
+    outage        上游全部断开时的接口表现，以及恢复后的第一次生成
+
+结果保存为 JSON，可以用 --compare 与之前的结果对比:
+    python offline_bench.py --latency 0.05 --out results/base.json
+    python offline_bench.py --latency 0.05 --compare results/base.json
+"""
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SCENARIOS = ('cold_start', 'steady_state', 'burst', 'outage')
+# 复制到临时目录时跳过的运行时数据和打包产物
+SANDBOX_IGNORE = {'data', 'variants', 'build', 'results', '__pycache__', '.venv', 'app.exe'}
+JOB_TIMEOUT = 120
+
+
+def percentile(sorted_values, p):
+    """最近秩百分位数"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+class LatencyRecorder:
+    """按操作名记录每次调用的耗时和成败"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, op, seconds, ok=True):
+        with self._lock:
+            samples = self._samples.setdefault(op, {'values': [], 'errors': 0, 'first': time.perf_counter() - seconds,
+                                                    'last': 0})
+            samples['values'].append(seconds)
+            samples['errors'] += not ok
+            samples['last'] = time.perf_counter()
+
+    def time(self, op, fn, *args, ok=None, **kwargs):
+        """调用 fn 并记录耗时，ok(result) 判断是否成功，fn 抛异常时记为失败并返回 None"""
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logging.warning(f"[bench] {op} 异常: {e}")
+            self.record(op, time.perf_counter() - start, ok=False)
+            return None
+        self.record(op, time.perf_counter() - start, ok=ok(result) if ok else True)
+        return result
+
+    def summary(self):
+        result = {}
+        with self._lock:
+            items = list(self._samples.items())
+        for op, samples in items:
+            values = sorted(samples['values'])
+            window = samples['last'] - samples['first']
+            result[op] = {
+                'count': len(values),
+                'errors': samples['errors'],
+                'mean_ms': round(sum(values) / len(values) * 1000, 2),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p90_ms': round(percentile(values, 90) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2),
+                'throughput_per_s': round(len(values) / window, 2) if window > 0 else None
+            }
+        return result
+
+
+def prepare_sandbox(root):
+    """复制后端代码和默认壁纸到 root"""
+
+    def ignore(directory, names):
+        ignored = {name for name in names if name in SANDBOX_IGNORE}
+        if os.path.basename(directory) == 'wallpapers':
+            ignored |= {name for name in names if name != 'default.jpg'}
+        return ignored
+
+    shutil.copytree(BACKEND_DIR, root, ignore=ignore, dirs_exist_ok=True)
+
+
+# ---------------- 子进程中运行的场景 ----------------
+
+def _ok_status(resp):
+    return resp.status_code < 400
+
+
+def _submit_refresh(client):
+    resp = client.post('/api/refresh-wallpaper')
+    return resp.get_json()['job_id'] if resp.status_code == 202 else None
+
+
+def _wait_job(app_module, job_id):
+    job = app_module.JOB_QUEUE.get(job_id)
+    if job is None or not job.wait(JOB_TIMEOUT):
+        return False
+    return job.status == 'done'
+
+
+def _wait_idle(app_module, timeout=JOB_TIMEOUT):
+    """等待已提交的任务全部结束"""
+    from wallpaper.job_queue import FINISHED_STATUSES
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        jobs = app_module.JOB_QUEUE.list_jobs()
+        if jobs and all(job.status in FINISHED_STATUSES for job in jobs):
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _refresh_and_wait(recorder, app_module, client, op):
+    start = time.perf_counter()
+    job_id = _submit_refresh(client)
+    ok = job_id is not None and _wait_job(app_module, job_id)
+    recorder.record(op, time.perf_counter() - start, ok)
+    return ok
+
+
+def scenario_cold_start(app_module, client, stubs, recorder, options):
+    recorder.time('first_auto_wallpaper', client.get, '/api/auto-wallpaper', ok=_ok_status)
+    recorder.time('first_weather', client.get, '/api/weather', ok=_ok_status)
+    _refresh_and_wait(recorder, app_module, client, 'first_generation')
+
+
+def scenario_steady_state(app_module, client, stubs, recorder, options):
+    # 相当于前端发送 ready_for_push，监控线程随即生成首张壁纸，结束后才进入稳定状态
+    start = time.perf_counter()
+    app_module.enabled_push.set()
+    ok = _wait_idle(app_module)
+    recorder.record('initial_generation', time.perf_counter() - start, ok)
+    etag = client.get('/api/auto-wallpaper').headers.get('ETag')
+    for _ in range(options['iterations']):
+        recorder.time('poll_weather', app_module.poll_weather)
+        recorder.time('time_mood_check', app_module.on_time_mood_boundary)
+        recorder.time('auto_wallpaper', client.get, '/api/auto-wallpaper', ok=_ok_status)
+        recorder.time('auto_wallpaper_304', client.get, '/api/auto-wallpaper', headers={'If-None-Match': etag},
+                      ok=lambda resp: resp.status_code == 304)
+        recorder.time('weather', client.get, '/api/weather', ok=_ok_status)
+
+
+def scenario_burst(app_module, client, stubs, recorder, options):
+    _refresh_and_wait(recorder, app_module, client, 'warm_up_generation')
+    submitted = []
+    for _ in range(options['burst']):
+        start = time.perf_counter()
+        job_id = recorder.time('refresh_submit', _submit_refresh, client, ok=lambda job_id: job_id is not None)
+        submitted.append((start, job_id))
+    for start, job_id in submitted:
+        ok = job_id is not None and _wait_job(app_module, job_id)
+        # 从提交到完成的耗时，包含排队时间
+        recorder.record('refresh_complete', time.perf_counter() - start, ok)
+
+
+def scenario_outage(app_module, client, stubs, recorder, options):
+    _refresh_and_wait(recorder, app_module, client, 'warm_up_generation')
+    stubs.configure(outage='reset')
+    for _ in range(options['outage_requests']):
+        recorder.time('weather_during_outage', client.get, '/api/weather', ok=_ok_status)
+        recorder.time('auto_wallpaper_during_outage', client.get, '/api/auto-wallpaper', ok=_ok_status)
+    # 强制重新获取位置和天气，而不是使用缓存
+    app_module.LOCATION_LOOKUP.invalidate()
+    app_module.WEATHER_CACHE.invalidate()
+    recorder.time('update_cache_during_outage', app_module.update_cache)
+    _refresh_and_wait(recorder, app_module, client, 'refresh_during_outage')
+    stubs.configure(outage=None)
+    _refresh_and_wait(recorder, app_module, client, 'refresh_after_recovery')
+
+
+def run_worker(scenario, sandbox, options, result_path):
+    """在子进程中运行单个场景，结果写入 result_path"""
+    # 与 app 相同的日志格式，必须在任何日志输出之前设置，否则 app 中的 basicConfig 不生效
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from stub_servers import StubUpstreams
+    import random
+    random.seed(options['seed'])
+
+    stubs = StubUpstreams({'latency': options['latency'], 'jitter': options['jitter'],
+                           'error_rate': options['error_rate'], 'image_bytes': options['image_bytes']}).start()
+    # http_client 在导入时读取重定向配置，必须在导入 app 之前设置
+    os.environ['WALLPAPER_UPSTREAM_OVERRIDES'] = stubs.env_value()
+    os.chdir(sandbox)
+    sys.path.insert(0, sandbox)
+
+    recorder = LatencyRecorder()
+    wall_start = time.perf_counter()
+    start = time.perf_counter()
+    import app as app_module
+    recorder.record('import_app', time.perf_counter() - start)
+    client = app_module.app.test_client()
+
+    globals()[f'scenario_{scenario}'](app_module, client, stubs, recorder, options)
+
+    result = {
+        'wall_seconds': round(time.perf_counter() - wall_start, 3),
+        'ops': recorder.summary(),
+        'upstreams': {name: {k: v for k, v in stats.items() if k != 'config'} for name, stats in stubs.stats().items()},
+        'app': client.get('/api/generation-stats').get_json()
+    }
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    stubs.stop()
+    # 后台线程（任务队列、定时器等）不会自行退出
+    os._exit(0)
+
+
+# ---------------- 父进程 ----------------
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_scenario(scenario, options, verbose=False):
+    with tempfile.TemporaryDirectory(prefix='wallpaper-bench-') as tmp:
+        sandbox = os.path.join(tmp, 'backend')
+        prepare_sandbox(sandbox)
+        result_path = os.path.join(tmp, 'result.json')
+        log_path = os.path.join(tmp, 'worker.log')
+        cmd = [sys.executable, os.path.abspath(__file__), '--worker', scenario, '--sandbox', sandbox,
+               '--result-file', result_path, '--options', json.dumps(options)]
+        with open(log_path, 'w', encoding='utf-8') as log:
+            proc = subprocess.run(cmd, stdout=None if verbose else log, stderr=subprocess.STDOUT if not verbose else None)
+        if proc.returncode != 0 or not os.path.exists(result_path):
+            with open(log_path, encoding='utf-8', errors='replace') as f:
+                tail = f.read()[-4000:]
+            raise RuntimeError(f"场景 {scenario} 运行失败 (退出码 {proc.returncode}):\n{tail}")
+        with open(result_path, encoding='utf-8') as f:
+            return json.load(f)
+
+
+def compare(current, baseline):
+    """打印两次结果中各操作 p50/p99 的变化"""
+    print(f"\n对比基准: {baseline['meta'].get('created_at')} ({baseline['meta'].get('git_commit')})")
+    print(f"{'场景/操作':<44}{'p50 ms':>22}{'p99 ms':>22}")
+    for scenario, result in current['scenarios'].items():
+        base_ops = baseline['scenarios'].get(scenario, {}).get('ops', {})
+        for op, stats in result['ops'].items():
+            base = base_ops.get(op)
+            if base is None:
+                continue
+            cells = []
+            for key in ('p50_ms', 'p99_ms'):
+                change = (stats[key] - base[key]) / base[key] * 100 if base[key] else 0
+                cells.append(f"{base[key]:>8.1f} -> {stats[key]:>7.1f} {change:+5.0f}%")
+            print(f"{scenario + '/' + op:<44}{cells[0]:>22}{cells[1]:>22}")
+
+
+def print_results(results):
+    for scenario, result in results['scenarios'].items():
+        print(f"\n[{scenario}] 总耗时 {result['wall_seconds']} s")
+        for op, stats in result['ops'].items():
+            print(f"  {op:<32} n={stats['count']:<5} err={stats['errors']:<3} p50={stats['p50_ms']:>9.1f}ms "
+                  f"p99={stats['p99_ms']:>9.1f}ms max={stats['max_ms']:>9.1f}ms")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='使用本地上游替身的离线基准测试')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'逗号分隔，可选 {",".join(SCENARIOS)}')
+    parser.add_argument('--latency', type=float, default=0.05, help='替身的固定延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='替身的随机延迟上限（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='替身返回 503 的概率')
+    parser.add_argument('--image-bytes', type=int, default=300 * 1024, help='图片响应大小（字节）')
+    parser.add_argument('--iterations', type=int, default=200, help='steady_state 的循环次数')
+    parser.add_argument('--burst', type=int, default=10, help='burst 同时提交的手动刷新数')
+    parser.add_argument('--outage-requests', type=int, default=20, help='outage 期间每个接口的请求次数')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='结果文件，默认 results/<时间>.json')
+    parser.add_argument('--compare', help='与之前的结果文件对比')
+    parser.add_argument('--verbose', action='store_true', help='显示后端日志')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--sandbox', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.sandbox, json.loads(args.options), args.result_file)
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+    options = {
+        'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+        'image_bytes': args.image_bytes, 'iterations': args.iterations, 'burst': args.burst,
+        'outage_requests': args.outage_requests, 'seed': args.seed
+    }
+    results = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': options
+        },
+        'scenarios': {}
+    }
+    for scenario in scenarios:
+        logging.info(f"[bench] 运行场景 {scenario} ...")
+        results['scenarios'][scenario] = run_scenario(scenario, options, args.verbose)
+
+    out = args.out or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_results(results)
+    print(f"\n结果已保存到 {out}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""
+各上游接口的本地替身服务，用于离线基准测试和压测
+
+每个上游一个 HTTP 服务，响应格式与真实接口一致，延迟、错误率、图片大小可以随时调整：
+在代码中修改 StubServer.config，或向任一替身发送 POST /__stub__/config。
+
+命令行（替身一直运行，配合 WALLPAPER_UPSTREAM_OVERRIDES 启动后端）:
+    python stub_servers.py --latency 0.05 --error-rate 0.1
+"""
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import struct
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 故障模式
+OUTAGE_ERROR = 'error'   # 返回 503
+OUTAGE_RESET = 'reset'   # 不返回响应直接断开连接
+OUTAGE_HANG = 'hang'     # 长时间不响应，触发客户端超时
+
+CONTROL_PATH = '/__stub__/config'
+
+_WORDS = ('misty', 'golden', 'quiet', 'harbor', 'forest', 'lantern', 'valley', 'aurora', 'meadow',
+          'snowy', 'rooftops', 'river', 'glowing', 'ancient', 'bridge', 'twilight', 'clouds', 'lake')
+
+
+class StubConfig:
+    """
+    替身服务的行为
+
+    Args:
+        latency: 固定延迟（秒）
+        jitter: 在固定延迟上叠加 0~jitter 秒的随机延迟
+        error_rate: 返回 503 的概率
+        image_bytes: 图片响应的大小（字节）
+        outage: None 或 OUTAGE_ERROR / OUTAGE_RESET / OUTAGE_HANG
+        hang_seconds: OUTAGE_HANG 时的等待时间
+    """
+
+    FIELDS = ('latency', 'jitter', 'error_rate', 'image_bytes', 'outage', 'hang_seconds')
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, image_bytes=300 * 1024, outage=None, hang_seconds=60):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.image_bytes = image_bytes
+        self.outage = outage
+        self.hang_seconds = hang_seconds
+
+    def update(self, **values):
+        for key, value in values.items():
+            if key not in self.FIELDS:
+                raise ValueError(f"未知的替身配置: {key}")
+            setattr(self, key, value)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+
+def make_jpeg(size, width=1704, height=960):
+    """
+    生成约 size 字节的 JPEG
+
+    安装了 PIL 时生成可以正常解码的图片（噪点多，压缩率低），再用 APP15 段补足大小
+    （不用注释段：PIL 重新编码时会保留注释，变体也会跟着变大）；
+    否则只构造文件头、SOF 和文件尾，能通过 image_probe 的校验但无法解码。
+    """
+    if Image is not None:
+        noise = Image.frombytes('L', (width // 8, height // 8), os.urandom(width // 8 * height // 8))
+        buf = io.BytesIO()
+        noise.convert('RGB').resize((width, height)).save(buf, 'JPEG', quality=70)
+        data = buf.getvalue()
+        padding = max(0, size - len(data))
+        segments = b''
+        while padding > 4:
+            chunk = min(padding - 4, 65533)
+            segments += b'\xff\xef' + struct.pack('>H', chunk + 2) + b'\x00' * chunk
+            padding -= chunk + 4
+        return data[:2] + segments + data[2:]
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    body = os.urandom(max(0, size - 40)).replace(b'\xff', b'\x00')
+    return b'\xff\xd8' + app0 + sof + b'\xff\xda' + body + b'\xff\xd9'
+
+
+class StubServer:
+    """
+    单个上游的替身
+
+    Args:
+        name: 名称
+        host: 被替换的上游 host，如 wis.qq.com
+        respond: respond(stub, path, query) -> (状态码, Content-Type, bytes)
+        config: StubConfig
+        port: 0 表示自动分配
+    """
+
+    def __init__(self, name, host, respond, config=None, port=0):
+        self.name = name
+        self.host = host
+        self.respond = respond
+        self.config = config or StubConfig()
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._stats = {'requests': 0, 'errors': 0, 'bytes': 0}
+        self._image = None
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def next_id(self):
+        return next(self._counter)
+
+    def image(self):
+        """按当前配置的大小生成图片，大小不变时复用"""
+        size = self.config.image_bytes
+        if self._image is None or self._image[0] != size:
+            self._image = (size, make_jpeg(size))
+        return self._image[1]
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, content_type, body, head=False):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+            def do_POST(self):
+                if not self.path.startswith(CONTROL_PATH):
+                    self._send(404, 'text/plain', b'not found')
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    stub.config.update(**json.loads(self.rfile.read(length) or b'{}'))
+                except ValueError as e:
+                    self._send(400, 'text/plain', str(e).encode('utf-8'))
+                    return
+                self._send(200, 'application/json', json.dumps(stub.config.to_dict()).encode('utf-8'))
+
+            def do_HEAD(self):
+                self._handle(head=True)
+
+            def do_GET(self):
+                self._handle(head=False)
+
+            def _handle(self, head):
+                config = stub.config
+                with stub._lock:
+                    stub._stats['requests'] += 1
+                if config.outage == OUTAGE_RESET:
+                    self.close_connection = True
+                    return
+                if config.outage == OUTAGE_HANG:
+                    time.sleep(config.hang_seconds)
+                    self.close_connection = True
+                    return
+                time.sleep(config.latency + random.random() * config.jitter)
+                if config.outage == OUTAGE_ERROR or random.random() < config.error_rate:
+                    with stub._lock:
+                        stub._stats['errors'] += 1
+                    self._send(503, 'text/plain', b'stub error', head)
+                    return
+                parts = urllib.parse.urlsplit(self.path)
+                status, content_type, body = stub.respond(stub, urllib.parse.unquote(parts.path),
+                                                          urllib.parse.parse_qs(parts.query))
+                with stub._lock:
+                    stub._stats['bytes'] += len(body)
+                self._send(status, content_type, body, head)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f'stub-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'config': self.config.to_dict()}
+
+
+def _json(data):
+    return 200, 'application/json; charset=utf-8', json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def respond_qq_weather(stub, path, query):
+    # 固定的天气，避免天气变化触发额外的生成，保证多次运行可比
+    observe = {
+        'weather': '晴',
+        'degree': '22',
+        'humidity': '60',
+        'wind_direction_name': '东北风',
+        'wind_power': '2',
+        # 只精确到分钟，和真实接口一样决定天气缓存的过期时间
+        'update_time': time.strftime('%Y%m%d%H%M')
+    }
+    return _json({'status': 200, 'message': 'OK', 'data': {'observe': observe}})
+
+
+def respond_iqiyi(stub, path, query):
+    return _json({'code': '0', 'msg': 'success',
+                  'data': {'provinceCN': '四川', 'cityCN': '成都', 'countyCN': '成华区'}})
+
+
+def respond_vore(stub, path, query):
+    return _json({'code': 200, 'msg': 'SUCCESS', 'ipdata': {'info1': '四川省', 'info2': '成都市', 'info3': '成华区'}})
+
+
+def respond_public_ip(stub, path, query):
+    return 200, 'text/plain', b'203.0.113.7'
+
+
+def _prompt(stub):
+    words = random.sample(_WORDS, 6)
+    return f"{' '.join(words)}, cinematic lighting, highly detailed wallpaper, variant {stub.next_id()}"
+
+
+def respond_text(stub, path, query):
+    # 批量生成的指令要求输出JSON数组
+    match = re.search(r'一次生成(\d+)条', path)
+    if match:
+        prompts = [_prompt(stub) for _ in range(int(match.group(1)))]
+        return 200, 'text/plain; charset=utf-8', json.dumps(prompts).encode('utf-8')
+    return 200, 'text/plain; charset=utf-8', _prompt(stub).encode('utf-8')
+
+
+def respond_image(stub, path, query):
+    return 200, 'image/jpeg', stub.image()
+
+
+# (名称, 被替换的 host, 响应函数)
+UPSTREAMS = (
+    ('qq_weather', 'wis.qq.com', respond_qq_weather),
+    ('iqiyi', 'mesh.if.iqiyi.com', respond_iqiyi),
+    ('vore', 'api.vore.top', respond_vore),
+    ('ipw', '4.ipw.cn', respond_public_ip),
+    ('ipify', 'api.ipify.org', respond_public_ip),
+    ('text', 'text.pollinations.ai', respond_text),
+    ('image', 'image.pollinations.ai', respond_image)
+)
+
+
+class StubUpstreams:
+    """
+    全部上游的替身
+
+    Args:
+        config: 各替身的默认配置字典，见 StubConfig
+        overrides: {名称: 配置字典}，单独调整某个替身
+    """
+
+    def __init__(self, config=None, overrides=None):
+        config = config or {}
+        overrides = overrides or {}
+        self.servers = {
+            name: StubServer(name, host, respond, StubConfig(**{**config, **overrides.get(name, {})}))
+            for name, host, respond in UPSTREAMS
+        }
+
+    def start(self):
+        for server in self.servers.values():
+            server.start()
+        logging.info(f"[stub] 已启动 {len(self.servers)} 个上游替身")
+        return self
+
+    def stop(self):
+        for server in self.servers.values():
+            server.stop()
+
+    def configure(self, names=None, **values):
+        """修改替身配置，names 为 None 时修改全部"""
+        for name in names or self.servers:
+            self.servers[name].config.update(**values)
+
+    def host_overrides(self):
+        return {server.host: server.base_url for server in self.servers.values()}
+
+    def env_value(self):
+        """WALLPAPER_UPSTREAM_OVERRIDES 环境变量的值"""
+        return ','.join(f"{host}={url}" for host, url in self.host_overrides().items())
+
+    def stats(self):
+        return {name: server.stats() for name, server in self.servers.items()}
+
+
+if __name__ == '__main__':
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description='启动全部上游替身服务')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--image-bytes', type=int, default=300 * 1024)
+    args = parser.parse_args()
+    stubs = StubUpstreams({'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+                           'image_bytes': args.image_bytes}).start()
+    print(f"set WALLPAPER_UPSTREAM_OVERRIDES={stubs.env_value()}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stubs.stop()
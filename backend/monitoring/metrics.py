@@ -0,0 +1,207 @@
+"""
+进程内指标，按 Prometheus 文本格式输出
+
+热路径上只有一次加锁和几次整数加法；各缓存已有的 stats() 统计通过 register_collector
+注册，在抓取时才读取，不增加请求开销。
+"""
+import bisect
+import math
+import threading
+
+# 默认的耗时分桶（秒），覆盖从本地缓存命中到生成一张壁纸的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labels}，实际为 {label_values}")
+        return tuple(str(v) for v in label_values)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可以任意设置的当前值"""
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    """
+    分桶统计，用于耗时
+
+    每个标签组合保存各桶（不累计）的计数、总和与次数，输出时再换算成累计值。
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        key = self._key(label_values)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 最后一格对应 +Inf
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self._header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, ('le', _format_value(float(bound))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(round(total, 6))}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """指标注册表，同名指标只创建一次"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, cls, name, help, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+                raise ValueError(f"指标 {name} 已以不同的类型或标签注册")
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get_or_create(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get_or_create(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labels, buckets=buckets)
+
+    def register_collector(self, collect):
+        """
+        注册抓取时调用的采集函数
+
+        collect() 返回 [(name, kind, help, [(labels_dict, value), ...]), ...]，
+        kind 为 'counter' 或 'gauge'。
+        """
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collect in collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=()):
+    return REGISTRY.counter(name, help, labels)
+
+
+def gauge(name, help, labels=()):
+    return REGISTRY.gauge(name, help, labels)
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help, labels, buckets)
+
+
+def register_collector(collect):
+    REGISTRY.register_collector(collect)
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,232 @@
+"""
+壁纸生成的阶段耗时追踪
+
+每次生成记录一棵 span 树（提示词、各模型请求、下载、重试等待、校验……），完成后放入
+固定大小的环形缓冲区，可以导出为 Chrome trace-event JSON，在 chrome://tracing 或
+Perfetto 中以火焰图查看。
+
+当前 span 保存在线程局部变量中：trace() 所在线程里调用的 span() 会挂到这棵树上，
+没有进行中的 trace 时 span() 不做任何记录。
+"""
+import collections
+import contextlib
+import itertools
+import threading
+import time
+import uuid
+
+# 默认保留的最近追踪数
+DEFAULT_CAPACITY = 50
+
+
+class Span:
+    def __init__(self, name, attrs, start):
+        self.name = name
+        self.attrs = attrs
+        self.start = start
+        self.end = None
+        self.error = None
+        self.thread = threading.current_thread().name
+        self.children = []
+
+    def to_dict(self, origin):
+        end = self.end if self.end is not None else time.perf_counter()
+        result = {
+            'name': self.name,
+            'offset_ms': round((self.start - origin) * 1000, 2),
+            'duration_ms': round((end - self.start) * 1000, 2),
+            'attrs': dict(self.attrs)
+        }
+        if self.end is None:
+            result['running'] = True
+        if self.error:
+            result['error'] = self.error
+        if self.children:
+            result['children'] = [child.to_dict(origin) for child in list(self.children)]
+        return result
+
+
+class Trace:
+    def __init__(self, name, attrs):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self.root = Span(name, attrs, time.perf_counter())
+
+    @property
+    def done(self):
+        return self.root.end is not None
+
+    def summary(self):
+        root = self.root.to_dict(self.root.start)
+        return {
+            'trace_id': self.trace_id,
+            'name': root['name'],
+            'started_at': self.started_at,
+            'duration_ms': root['duration_ms'],
+            'running': not self.done,
+            'error': self.root.error,
+            'attrs': root['attrs']
+        }
+
+    def to_dict(self):
+        return {**self.summary(), 'root': self.root.to_dict(self.root.start)}
+
+    def chrome_events(self, pid, tid):
+        """转换为 Chrome trace-event 的完整事件（ph=X），时间单位为微秒"""
+        base_us = self.started_at * 1e6
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': f"{self.root.name} {self.trace_id}"}}]
+        stack = [self.root]
+        while stack:
+            span = stack.pop()
+            end = span.end if span.end is not None else time.perf_counter()
+            args = dict(span.attrs)
+            if span.error:
+                args['error'] = span.error
+            events.append({
+                'name': span.name,
+                'cat': 'wallpaper',
+                'ph': 'X',
+                'ts': round(base_us + (span.start - self.root.start) * 1e6, 1),
+                'dur': round((end - span.start) * 1e6, 1),
+                'pid': pid,
+                'tid': tid,
+                'args': args
+            })
+            stack.extend(span.children)
+        return events
+
+
+class Tracer:
+    """
+    追踪记录器
+
+    Args:
+        capacity: 环形缓冲区保留的已完成追踪数
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._finished = collections.deque(maxlen=capacity)
+        self._active = {}
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextlib.contextmanager
+    def trace(self, name, **attrs):
+        """开始一次追踪；当前线程已有进行中的追踪时等同于 span()"""
+        stack = self._stack()
+        if stack:
+            with self.span(name, **attrs) as span:
+                yield span
+            return
+        trace = Trace(name, attrs)
+        with self._lock:
+            self._active[trace.trace_id] = trace
+        stack.append(trace.root)
+        try:
+            yield trace.root
+        except BaseException as e:
+            trace.root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            stack.pop()
+            trace.root.end = time.perf_counter()
+            with self._lock:
+                self._active.pop(trace.trace_id, None)
+                self._finished.append(trace)
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """记录一个阶段，没有进行中的追踪时直接执行"""
+        stack = self._stack()
+        if not stack:
+            yield None
+            return
+        span = Span(name, attrs, time.perf_counter())
+        stack[-1].children.append(span)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            stack.pop()
+            span.end = time.perf_counter()
+
+    def record_span(self, name, duration, **attrs):
+        """补记一个刚结束、耗时为 duration 秒的阶段，用于只在结束时回调的调用"""
+        stack = self._stack()
+        if not stack:
+            return
+        end = time.perf_counter()
+        span = Span(name, attrs, end - duration)
+        span.end = end
+        stack[-1].children.append(span)
+
+    def annotate(self, **attrs):
+        """给当前 span 添加属性"""
+        stack = self._stack()
+        if stack:
+            stack[-1].attrs.update(attrs)
+
+    def _traces(self):
+        with self._lock:
+            return list(self._active.values()) + list(self._finished)
+
+    def recent(self, limit=None):
+        """进行中和最近完成的追踪摘要，新的在前"""
+        traces = sorted(self._traces(), key=lambda t: t.started_at, reverse=True)
+        return [trace.summary() for trace in traces[:limit]]
+
+    def get(self, trace_id):
+        for trace in self._traces():
+            if trace.trace_id == trace_id:
+                return trace.to_dict()
+        return None
+
+    def chrome_trace(self, trace_ids=None):
+        """导出为 Chrome trace-event JSON，每个追踪显示为一行"""
+        traces = sorted(self._traces(), key=lambda t: t.started_at)
+        if trace_ids is not None:
+            traces = [t for t in traces if t.trace_id in trace_ids]
+        tids = itertools.count(1)
+        events = [event for trace in traces for event in trace.chrome_events(1, next(tids))]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+_tracer = Tracer()
+
+
+def trace(name, **attrs):
+    return _tracer.trace(name, **attrs)
+
+
+def span(name, **attrs):
+    return _tracer.span(name, **attrs)
+
+
+def record_span(name, duration, **attrs):
+    _tracer.record_span(name, duration, **attrs)
+
+
+def annotate(**attrs):
+    _tracer.annotate(**attrs)
+
+
+def recent(limit=None):
+    return _tracer.recent(limit)
+
+
+def get(trace_id):
+    return _tracer.get(trace_id)
+
+
+def chrome_trace(trace_ids=None):
+    return _tracer.chrome_trace(trace_ids)
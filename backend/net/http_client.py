@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from monitoring import metrics
+
+# 启动时预热连接的上游地址
+DEFAULT_WARM_UP_URLS = [
+    'https://wis.qq.com/',
+    'https://mesh.if.iqiyi.com/',
+    'https://api.vore.top/',
+    'https://text.pollinations.ai/',
+    'https://image.pollinations.ai/'
+]
+
+# 把上游 host 重定向到其他地址，格式 "wis.qq.com=http://127.0.0.1:18001,api.vore.top=http://127.0.0.1:18002"，
+# 用于离线基准测试和压测时指向本地替身服务
+OVERRIDES_ENV = 'WALLPAPER_UPSTREAM_OVERRIDES'
+
+UPSTREAM_SECONDS = metrics.histogram('wallpaper_upstream_request_seconds', '上游接口请求耗时（秒），流式下载只统计到响应头',
+                                     ('upstream',))
+UPSTREAM_REQUESTS = metrics.counter('wallpaper_upstream_requests_total', '上游接口请求次数',
+                                    ('upstream', 'outcome'))
+
+
+class HttpClient:
+    """
+    所有上游接口共用的 HTTP 客户端
+
+    每个 host 一个 requests.Session，连接保持 keep-alive 并在后续请求中复用，
+    省去每次调用的 TCP+TLS 握手。不使用线程局部状态，gevent monkey patch 后
+    同样可以在多个 greenlet 间共享。
+
+    Args:
+        pool_maxsize: 每个 host 的最大连接数
+        overrides: {host: base_url}，请求这些 host 时改为请求 base_url，统计仍按原 host 记录
+    """
+
+    def __init__(self, pool_maxsize=4, overrides=None):
+        self.pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._stats = {}
+        self._overrides = {}
+        for host, base_url in (overrides or {}).items():
+            self.set_override(host, base_url)
+
+    def set_override(self, host, base_url):
+        """把 host 的请求重定向到 base_url（如 http://127.0.0.1:18001），base_url 为 None 时取消"""
+        with self._lock:
+            if base_url is None:
+                self._overrides.pop(host, None)
+            else:
+                self._overrides[host] = urllib.parse.urlsplit(base_url)
+        logging.info(f"[http_client] 上游重定向 {host} -> {base_url}")
+
+    def _rewrite(self, url):
+        parts = urllib.parse.urlsplit(url)
+        target = self._overrides.get(parts.netloc)
+        if target is None:
+            return parts.netloc, url
+        return parts.netloc, urllib.parse.urlunsplit((target.scheme, target.netloc, target.path.rstrip('/') + parts.path,
+                                                      parts.query, parts.fragment))
+
+    def _session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                self._stats[host] = {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'last_ms': None}
+            return session
+
+    def request(self, method, url, **kwargs):
+        host, url = self._rewrite(url)
+        session = self._session(host)
+        start = time.perf_counter()
+        outcome = 'exception'
+        try:
+            resp = session.request(method, url, **kwargs)
+            outcome = 'ok' if resp.status_code < 400 else 'http_error'
+            return resp
+        except Exception:
+            with self._lock:
+                self._stats[host]['errors'] += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            UPSTREAM_SECONDS.observe(elapsed_ms / 1000, host)
+            UPSTREAM_REQUESTS.inc(host, outcome)
+            with self._lock:
+                stats = self._stats[host]
+                stats['calls'] += 1
+                stats['total_ms'] += elapsed_ms
+                stats['last_ms'] = elapsed_ms
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def warm_up(self, urls=None, timeout=3):
+        """并发向各上游发起 HEAD 请求，提前建立连接"""
+        urls = urls or DEFAULT_WARM_UP_URLS
+
+        def _warm(url):
+            start = time.perf_counter()
+            try:
+                self.head(url, timeout=timeout, allow_redirects=False)
+                logging.info(f"[http_client] 预热连接 {url} 耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+            except Exception as e:
+                logging.warning(f"[http_client] 预热连接 {url} 失败: {e}")
+
+        threads = [threading.Thread(target=_warm, args=(url,), daemon=True) for url in urls]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout + 1)
+
+    def _new_connections(self, session):
+        adapter = session.get_adapter('https://')
+        pools = adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def stats(self):
+        """每个 host 的调用次数、平均耗时和新建连接数，新建连接数远小于调用次数说明连接被复用"""
+        with self._lock:
+            items = list(self._stats.items())
+            sessions = dict(self._sessions)
+        result = {}
+        for host, stats in items:
+            calls = stats['calls']
+            result[host] = {
+                'calls': calls,
+                'errors': stats['errors'],
+                'avg_ms': round(stats['total_ms'] / calls, 1) if calls else None,
+                'last_ms': round(stats['last_ms'], 1) if stats['last_ms'] is not None else None,
+                'new_connections': self._new_connections(sessions[host])
+            }
+        return result
+
+
+def parse_overrides(value):
+    """解析 OVERRIDES_ENV 格式的字符串"""
+    overrides = {}
+    for item in (value or '').split(','):
+        host, sep, base_url = item.strip().partition('=')
+        if sep and host and base_url:
+            overrides[host.strip()] = base_url.strip()
+    return overrides
+
+
+_client = HttpClient(overrides=parse_overrides(os.environ.get(OVERRIDES_ENV)))
+
+
+def get(url, **kwargs):
+    """与 requests.get 参数一致，使用共享连接池"""
+    return _client.get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    return _client.head(url, **kwargs)
+
+
+def set_override(host, base_url):
+    _client.set_override(host, base_url)
+
+
+def warm_up(urls=None, timeout=3):
+    _client.warm_up(urls, timeout)
+
+
+def stats():
+    return _client.stats()
@@ -0,0 +1,104 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# 单次等待的最长时间（秒），用于系统休眠唤醒或校时后重新核对到期时间
+MAX_WAIT = 300
+
+
+class TimerScheduler:
+    """
+    基于最小堆的定时任务调度器
+
+    每个任务有自己的节奏：执行完后调用 next_run(now) 计算下一次执行的时间戳，
+    调度线程只在最近一个任务到期时醒来，执行耗时不会推迟其他任务的计划时间。
+    同一时刻到期的任务按 order 从小到大依次执行。
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._tasks = {}
+
+    def add(self, name, func, next_run, first_run=None, order=0):
+        """
+        添加任务
+
+        Args:
+            name: 任务名，同名任务会被替换
+            func: 到期时执行的函数，无参数
+            next_run: 计算下一次执行时间的函数 next_run(now_ts) -> ts
+            first_run: 第一次执行的时间戳，默认由 next_run 计算
+            order: 与其他任务同一时刻到期时的执行顺序，小的先执行
+        """
+        run_at = first_run if first_run is not None else next_run(time.time())
+        with self._cond:
+            task = {'name': name, 'func': func, 'next_run': next_run, 'run_at': run_at, 'order': order,
+                    'runs': 0, 'last_run_at': None, 'last_duration': None}
+            self._tasks[name] = task
+            self._push(task)
+            self._cond.notify()
+        logging.info(f"[scheduler] 添加任务 {name}，下次执行: {time.strftime('%H:%M:%S', time.localtime(run_at))}")
+
+    def trigger(self, name):
+        """让任务尽快执行一次"""
+        with self._cond:
+            task = self._tasks.get(name)
+            if task is None:
+                return False
+            task['run_at'] = time.time()
+            self._push(task)
+            self._cond.notify()
+        return True
+
+    def start(self):
+        threading.Thread(target=self.run_forever, name='timer-scheduler', daemon=True).start()
+
+    def run_forever(self):
+        while True:
+            task = self._wait_next()
+            start = time.time()
+            try:
+                task['func']()
+            except Exception as e:
+                logging.error(f"[scheduler] 任务 {task['name']} 执行失败: {e}")
+            end = time.time()
+            with self._cond:
+                task['runs'] += 1
+                task['last_run_at'] = start
+                task['last_duration'] = end - start
+                # 任务可能在执行期间被 trigger 或替换，只为当前登记的任务重新排期
+                if self._tasks.get(task['name']) is task and task['run_at'] <= start:
+                    task['run_at'] = max(task['next_run'](end), end)
+                    self._push(task)
+
+    def _push(self, task):
+        heapq.heappush(self._heap, (task['run_at'], task['order'], next(self._counter), task))
+
+    def _wait_next(self):
+        with self._cond:
+            while True:
+                # 丢弃被替换或已重新排期的旧条目
+                while self._heap and (self._heap[0][3]['run_at'] != self._heap[0][0]
+                                      or self._tasks.get(self._heap[0][3]['name']) is not self._heap[0][3]):
+                    heapq.heappop(self._heap)
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[3]
+                timeout = min(self._heap[0][0] - now, MAX_WAIT) if self._heap else MAX_WAIT
+                self._cond.wait(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                name: {
+                    'next_run_at': task['run_at'],
+                    'runs': task['runs'],
+                    'last_run_at': task['last_run_at'],
+                    'last_duration': task['last_duration']
+                }
+                for name, task in self._tasks.items()
+            }
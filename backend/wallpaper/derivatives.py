@@ -0,0 +1,226 @@
+import base64
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wallpaper.single_flight import SingleFlight
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 预设尺寸（宽度），保持原图宽高比
+VARIANT_PRESETS = {
+    'thumb': 320,
+    'preview': 960
+}
+# 按请求尺寸选取变体时可用的宽度档位，避免为任意尺寸都生成文件
+WIDTH_LADDER = (320, 640, 960, 1280, 1600, 1920, 2560, 3840)
+# 最多记录的显示器宽度
+MAX_DISPLAYS = 8
+# 内联占位图的宽度
+PLACEHOLDER_WIDTH = 32
+# 等待变体生成时检查的间隔（秒）
+WAIT_INTERVAL = 0.05
+
+
+def make_placeholder(path, width=PLACEHOLDER_WIDTH):
+    """
+    生成极小的 JPEG 占位图，返回 data URI（通常不到 1KB），未安装 PIL 或失败时返回 None
+
+    前端先把占位图模糊后铺满屏幕，完整壁纸加载完成后再淡入。
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as img:
+            height = max(1, round(img.height * width / img.width))
+            img.draft('RGB', (width, height))
+            img = img.convert('RGB').resize((width, height), Image.BILINEAR)
+            buf = io.BytesIO()
+            img.save(buf, 'JPEG', quality=50)
+        return 'data:image/jpeg;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+    except Exception as e:
+        logging.warning(f"[derivatives] 生成占位图失败 {path}: {e}")
+        return None
+
+
+class WallpaperDerivatives:
+    """
+    壁纸的多分辨率变体
+
+    新壁纸生成后由 warm() 在线程池中预先生成预设尺寸和已登记显示器宽度的变体，
+    其他宽度在首次请求时生成并缓存到 cache_dir。可用宽度为 WIDTH_LADDER 加上
+    已登记显示器的实际宽度；请求尺寸不小于原图、变体尚未生成完或未安装 PIL 时返回原图。
+
+    变体尚未生成时，请求最多等待 wait_timeout 秒，期间用 sleep 轮询：服务端运行在 gevent 中
+    且没有 monkey patch，直接等待线程会阻塞整个事件循环，因此 app 传入 socketio.sleep。
+
+    Args:
+        library: WallpaperLibrary 实例，用于获取原图尺寸
+        cache_dir: 变体文件目录
+        workers: 缩放线程数
+        wait_timeout: 请求等待变体生成的最长时间（秒），超时先返回原图，变体继续在后台生成
+        sleep: 等待时使用的 sleep 函数
+    """
+
+    def __init__(self, library, cache_dir, workers=2, wait_timeout=5, sleep=time.sleep):
+        self.library = library
+        self.cache_dir = cache_dir
+        self.wait_timeout = wait_timeout
+        self.sleep = sleep
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wallpaper-resize')
+        self._flight = SingleFlight('derivatives')
+        self._lock = threading.Lock()
+        self._displays = []
+        # 原图文件名（不含扩展名）-> 已生成的变体文件名，淘汰原图时不用扫描目录
+        self._variants = {}
+        self._stats = {'hits': 0, 'created': 0, 'originals': 0, 'errors': 0, 'pending': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_variants()
+        if Image is None:
+            logging.info("[derivatives] 未安装 PIL，所有请求直接返回原图")
+
+    def _load_variants(self):
+        """启动时登记已有的变体文件，只扫描一次目录"""
+        for name in os.listdir(self.cache_dir):
+            stem, sep, _ = name.rpartition('@')
+            if sep and not name.endswith('.part'):
+                self._variants.setdefault(stem, set()).add(name)
+
+    def register_display(self, width, dpr=1.0):
+        """登记显示器的物理宽度，之后该宽度可以精确匹配（变体保持原图比例，只需宽度）"""
+        width = int(round(width * dpr))
+        if width <= 0:
+            raise ValueError(f"无效的显示器宽度: {width}")
+        with self._lock:
+            if width in self._displays:
+                return
+            self._displays.append(width)
+            del self._displays[:-MAX_DISPLAYS]
+        logging.info(f"[derivatives] 登记显示器宽度: {width}")
+
+    def displays(self):
+        with self._lock:
+            return list(self._displays)
+
+    def _choose_width(self, original_size, width=None, height=None, dpr=1.0, preset=None):
+        """返回变体宽度，原图已经足够时返回 None"""
+        orig_w, orig_h = original_size
+        if preset is not None:
+            target = VARIANT_PRESETS[preset]
+        else:
+            # 按原图比例铺满 width x height 所需的宽度
+            need_w = (width or 0) * dpr
+            need_h = (height or 0) * dpr * orig_w / orig_h
+            target = max(need_w, need_h)
+            if not target:
+                return None
+            candidates = sorted(set(WIDTH_LADDER) | set(self.displays()))
+            target = next((w for w in candidates if w >= target), None)
+        if target is None or target >= orig_w:
+            return None
+        return target
+
+    def variant_name(self, filename, width):
+        stem = os.path.splitext(filename)[0]
+        return f"{stem}@{width}w.jpg"
+
+    def _remember(self, filename, name):
+        with self._lock:
+            self._variants.setdefault(os.path.splitext(filename)[0], set()).add(name)
+
+    def _create(self, filename, source_path, target_path, width):
+        with Image.open(source_path) as img:
+            height = max(1, round(img.height * width / img.width))
+            # JPEG 解码时直接按比例缩小，省去大部分解码开销
+            img.draft('RGB', (width, height))
+            img = img.convert('RGB').resize((width, height), Image.LANCZOS)
+            tmp_path = target_path + '.part'
+            img.save(tmp_path, 'JPEG', quality=85, optimize=True, progressive=True)
+        os.replace(tmp_path, target_path)
+        self._remember(filename, os.path.basename(target_path))
+        self._stats['created'] += 1
+        logging.info(f"[derivatives] 生成变体 {os.path.basename(target_path)}")
+        return target_path
+
+    def _create_shared(self, filename, source_path, target_path, width):
+        result, _ = self._flight.do(target_path, self._create, filename, source_path, target_path, width)
+        return result
+
+    def resolve(self, filename, width=None, height=None, dpr=1.0, preset=None):
+        """
+        为请求选择最合适的文件
+
+        Returns:
+            (目录, 文件名, 变体宽度)，返回原图时变体宽度为 None
+        """
+        original = (self.library.wallpaper_dir, filename, None)
+        entry = self.library.get(filename)
+        if Image is None or entry is None or not entry['width'] or not entry['height']:
+            self._stats['originals'] += 1
+            return original
+        variant_width = self._choose_width((entry['width'], entry['height']), width, height, dpr, preset)
+        if variant_width is None:
+            self._stats['originals'] += 1
+            return original
+
+        name = self.variant_name(filename, variant_width)
+        target_path = os.path.join(self.cache_dir, name)
+        if os.path.exists(target_path):
+            self._stats['hits'] += 1
+            return self.cache_dir, name, variant_width
+
+        future = self._submit(filename, variant_width)
+        deadline = time.monotonic() + self.wait_timeout
+        while not future.done() and time.monotonic() < deadline:
+            self.sleep(WAIT_INTERVAL)
+        if not future.done():
+            # 继续在后台生成，下次请求即可命中
+            self._stats['pending'] += 1
+            return original
+        if future.exception() is not None:
+            return original
+        return self.cache_dir, name, variant_width
+
+    def _submit(self, filename, width):
+        source_path = os.path.join(self.library.wallpaper_dir, filename)
+        target_path = os.path.join(self.cache_dir, self.variant_name(filename, width))
+        future = self._executor.submit(self._create_shared, filename, source_path, target_path, width)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def _log_failure(self, future):
+        error = future.exception()
+        if error is not None:
+            self._stats['errors'] += 1
+            logging.warning(f"[derivatives] 生成变体失败: {error}")
+
+    def warm(self, filename):
+        """为新壁纸在后台生成预设尺寸和已登记显示器宽度的变体"""
+        entry = self.library.get(filename)
+        if Image is None or entry is None or not entry['width']:
+            return
+        widths = {w for w in (*VARIANT_PRESETS.values(), *self.displays()) if w < entry['width']}
+        for width in sorted(widths):
+            if not os.path.exists(os.path.join(self.cache_dir, self.variant_name(filename, width))):
+                self._submit(filename, width)
+
+    def remove(self, filename):
+        """删除某张壁纸的全部变体，在原图被淘汰时调用"""
+        with self._lock:
+            names = self._variants.pop(os.path.splitext(filename)[0], ())
+        for name in names:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"[derivatives] 删除变体失败 {name}: {e}")
+
+    def stats(self):
+        return {**self._stats, 'available': Image is not None, 'displays': self.displays()}
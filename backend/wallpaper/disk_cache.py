@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+
+# 壁纸目录磁盘配额
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+# 超过该天数未展示的壁纸会被清理，None 表示不按时间清理
+DEFAULT_MAX_AGE_DAYS = 90
+
+
+class WallpaperDiskCache:
+    """
+    壁纸目录的磁盘缓存管理，按最近展示时间做 LRU 淘汰
+
+    占用统计直接来自壁纸库索引，不需要扫描目录；每轮只淘汰少量文件，
+    在后台线程中逐步把占用降到配额以内。
+
+    Args:
+        library: WallpaperLibrary 实例
+        max_bytes: 磁盘配额（字节）
+        max_age_days: 最长保留天数
+        pinned: 返回需要保留的文件名集合的函数（默认壁纸、当前壁纸等）
+        batch_size: 每轮最多淘汰的文件数
+        on_evict: 可选回调 on_evict(filename)，壁纸被淘汰后调用（如清理派生文件）
+    """
+
+    def __init__(self, library, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                 pinned=None, batch_size=20, on_evict=None):
+        self.library = library
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.pinned = pinned or (lambda: set())
+        self.batch_size = batch_size
+        self.on_evict = on_evict
+        self._wake = threading.Event()
+        self._stats = {'files_evicted': 0, 'bytes_reclaimed': 0, 'last_run_at': None}
+        self._started = False
+
+    def start(self, interval=600):
+        """启动后台清理线程，interval 为两轮之间的最长间隔（秒）"""
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._loop, args=(interval,), name='wallpaper-disk-cache', daemon=True).start()
+
+    def notify(self):
+        """有新文件写入时调用，尽快触发一轮检查"""
+        self._wake.set()
+
+    def _loop(self, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                # 一轮淘汰满批说明仍可能超额，继续下一轮
+                while self.run_once() >= self.batch_size:
+                    time.sleep(0.1)
+            except Exception as e:
+                logging.error(f"[disk_cache] 清理失败: {e}")
+
+    def _last_used(self, entry):
+        return entry['last_shown_at'] or entry['created_at'] or 0
+
+    def run_once(self):
+        """执行一轮淘汰，返回本轮删除的文件数"""
+        now = time.time()
+        pinned = {name for name in self.pinned() if name}
+        candidates = [
+            e for e in self.library.entries()
+            if e['filename'] not in pinned and not e['favorite']
+        ]
+        candidates.sort(key=self._last_used)
+
+        footprint = self.library.total_bytes()
+        max_age = self.max_age_days * 86400 if self.max_age_days else None
+        evicted = []
+        for entry in candidates:
+            if len(evicted) >= self.batch_size:
+                break
+            expired = max_age is not None and now - self._last_used(entry) > max_age
+            if footprint <= self.max_bytes and not expired:
+                # 候选按最近使用时间排序，后面的只会更新
+                break
+            size = self._evict(entry)
+            if size is None:
+                continue
+            footprint -= size
+            evicted.append((entry['filename'], size))
+
+        self._stats['last_run_at'] = now
+        if evicted:
+            reclaimed = sum(size for _, size in evicted)
+            logging.info(f"[disk_cache] 淘汰 {len(evicted)} 张壁纸，释放 {reclaimed / 1024 / 1024:.1f} MB，"
+                         f"当前占用 {footprint / 1024 / 1024:.1f} MB")
+        return len(evicted)
+
+    def _evict(self, entry):
+        path = os.path.join(self.library.wallpaper_dir, entry['filename'])
+        size = entry['size'] or 0
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"[disk_cache] 删除文件失败 {path}: {e}")
+            return None
+        self.library.remove(entry['filename'])
+        if self.on_evict:
+            try:
+                self.on_evict(entry['filename'])
+            except Exception as e:
+                logging.warning(f"[disk_cache] 淘汰回调失败 {entry['filename']}: {e}")
+        self._stats['files_evicted'] += 1
+        self._stats['bytes_reclaimed'] += size
+        return size
+
+    def stats(self):
+        return {
+            **self._stats,
+            'footprint_bytes': self.library.total_bytes(),
+            'max_bytes': self.max_bytes,
+            'max_age_days': self.max_age_days
+        }
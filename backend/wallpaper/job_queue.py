@@ -0,0 +1,225 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+# 任务优先级：数值越小越先执行
+PRIORITY_MANUAL = 0     # 手动刷新
+PRIORITY_SCHEDULED = 1  # 时间/天气/整点触发
+PRIORITY_PREFETCH = 2   # 后台预生成
+
+# 执行通道：每个通道有自己的工作线程，手动刷新不会排在正在执行的定时生成或预生成之后
+LANE_MANUAL = 'manual'
+LANE_BACKGROUND = 'background'
+DEFAULT_LANES = {
+    LANE_MANUAL: (PRIORITY_MANUAL,),
+    LANE_BACKGROUND: (PRIORITY_SCHEDULED, PRIORITY_PREFETCH)
+}
+
+# 任务状态
+STATUS_QUEUED = 'queued'
+STATUS_PROMPTING = 'prompting'
+STATUS_DOWNLOADING = 'downloading'
+STATUS_VALIDATING = 'validating'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class WallpaperJob:
+    """一次壁纸生成任务"""
+
+    def __init__(self, priority, trigger, params, lane=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.priority = priority
+        self.lane = lane
+        self.trigger = trigger
+        self.params = params
+        self.status = STATUS_QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.key = None
+        self.done_event = threading.Event()
+        self._reporter = None
+
+    def report(self, status):
+        """由生成流程调用，上报当前阶段"""
+        if self._reporter:
+            self._reporter(self, status)
+
+    def wait(self, timeout=None):
+        return self.done_event.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'priority': self.priority,
+            'lane': self.lane,
+            'trigger': self.trigger,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class WallpaperJobQueue:
+    """
+    带优先级的壁纸生成任务队列
+
+    Args:
+        runner: 执行任务的函数 runner(job) -> dict，抛出异常视为失败
+        on_update: 任务状态变化回调 on_update(job)，用于推送进度
+        lanes: {通道名: 该通道执行的优先级}，缺省为 DEFAULT_LANES；通道内按优先级排队
+        workers: 每个通道的工作线程数
+        max_history: 保留的已完成任务数量
+    """
+
+    def __init__(self, runner, on_update=None, lanes=None, workers=1, max_history=100):
+        self.runner = runner
+        self.on_update = on_update
+        self.lanes = dict(lanes or DEFAULT_LANES)
+        self.workers = workers
+        self.max_history = max_history
+        self._lane_of = {priority: lane for lane, priorities in self.lanes.items() for priority in priorities}
+        self._heaps = {lane: [] for lane in self.lanes}
+        self._counter = itertools.count()
+        self._jobs = {}
+        # 去重键 -> 排队中或执行中的任务
+        self._active_keys = {}
+        self._stats = {'submitted': 0, 'coalesced': 0}
+        self._finished_order = []
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        for lane in self.lanes:
+            for i in range(self.workers):
+                threading.Thread(target=self._worker_loop, args=(lane,), name=f'wallpaper-job-{lane}-{i}',
+                                 daemon=True).start()
+
+    def submit(self, priority=PRIORITY_SCHEDULED, trigger='scheduled', key=None, **params):
+        """
+        提交任务，立即返回任务对象
+
+        key 不为 None 时，相同 key 的任务正在排队或执行则不再新建，直接返回该任务
+        """
+        lane = self._lane_of.get(priority)
+        if lane is None:
+            raise ValueError(f"没有通道执行优先级为 {priority} 的任务")
+        job = WallpaperJob(priority, trigger, params, lane)
+        job.key = key
+        job._reporter = self._set_status
+        with self._cond:
+            self._stats['submitted'] += 1
+            existing = self._active_keys.get(key) if key is not None else None
+            if existing is not None:
+                self._stats['coalesced'] += 1
+                logging.info(f"[job_queue] 合并到进行中的任务 {existing.job_id} (trigger={trigger}, key={key})")
+                return existing
+            if key is not None:
+                self._active_keys[key] = job
+            self._jobs[job.job_id] = job
+            # 同优先级按提交顺序执行
+            heapq.heappush(self._heaps[lane], (priority, next(self._counter), job))
+            # 各通道共用一个条件变量，需要唤醒全部等待的工作线程
+            self._cond.notify_all()
+        logging.info(f"[job_queue] 提交任务 {job.job_id} (trigger={trigger}, priority={priority}, lane={lane})")
+        self._notify(job)
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._cond:
+            jobs = list(self._jobs.values())
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def pending_count(self):
+        with self._cond:
+            return sum(len(heap) for heap in self._heaps.values())
+
+    def stats(self):
+        with self._cond:
+            return {**self._stats, 'pending': sum(len(heap) for heap in self._heaps.values()),
+                    'active': len(self._active_keys)}
+
+    def cancel(self, job):
+        """取消尚未开始执行的任务，返回是否取消成功"""
+        with self._cond:
+            if job.started_at is not None or job.status in FINISHED_STATUSES:
+                return False
+            job.status = STATUS_CANCELLED
+            job.finished_at = time.time()
+            self._release_key(job)
+        logging.info(f"[job_queue] 取消任务 {job.job_id}")
+        self._remember_finished(job)
+        job.done_event.set()
+        self._notify(job)
+        return True
+
+    def _set_status(self, job, status):
+        job.status = status
+        self._notify(job)
+
+    def _notify(self, job):
+        if not self.on_update:
+            return
+        try:
+            self.on_update(job)
+        except Exception as e:
+            logging.warning(f"[job_queue] 推送任务状态失败: {e}")
+
+    def _worker_loop(self, lane):
+        heap = self._heaps[lane]
+        while True:
+            with self._cond:
+                while not heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(heap)
+                if job.status == STATUS_CANCELLED:
+                    continue
+                job.started_at = time.time()
+            self._run(job)
+
+    def _run(self, job):
+        try:
+            job.result = self.runner(job)
+            job.status = STATUS_DONE
+        except Exception as e:
+            logging.error(f"[job_queue] 任务 {job.job_id} 失败: {e}")
+            job.error = str(e)
+            job.status = STATUS_FAILED
+        job.finished_at = time.time()
+        with self._cond:
+            self._release_key(job)
+        logging.info(f"[job_queue] 任务 {job.job_id} 结束: {job.status}, 耗时 {job.finished_at - job.started_at:.1f}s")
+        self._remember_finished(job)
+        job.done_event.set()
+        self._notify(job)
+
+    def _release_key(self, job):
+        if job.key is not None and self._active_keys.get(job.key) is job:
+            del self._active_keys[job.key]
+
+    def _remember_finished(self, job):
+        with self._cond:
+            self._finished_order.append(job.job_id)
+            while len(self._finished_order) > self.max_history:
+                old_id = self._finished_order.pop(0)
+                self._jobs.pop(old_id, None)
@@ -0,0 +1,328 @@
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from ai_image.image_probe import probe_image_file
+
+# 壁纸复用策略
+DEFAULT_REUSE_POLICY = {
+    'enabled': True,
+    'min_pool_size': 5,          # 同条件壁纸数量达到该值才复用，否则走上游生成
+    'min_repeat_interval': 24 * 3600,  # 同一张壁纸两次展示的最小间隔（秒）
+    'reuse_probability': 0.7     # 满足条件时复用的概率，保留一定比例的新图
+}
+
+_COLUMNS = ('filename', 'prompt', 'time_mood', 'weather_key', 'season',
+            'width', 'height', 'format', 'size', 'sha256', 'created_at', 'last_shown_at', 'show_count', 'favorite',
+            'placeholder')
+
+
+def file_sha256(path, chunk_size=65536):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class WallpaperLibrary:
+    """
+    按生成条件索引的壁纸库
+
+    所有记录保存在 SQLite 中，同时在内存里按 (time_mood, weather_key, season) 和提示词建立索引，
+    挑选可复用壁纸、按提示词查找和查询当前壁纸都不需要访问磁盘。
+    首次建库时目录中已有的壁纸由 start() 在后台线程中登记，读取尺寸和计算哈希不阻塞启动。
+
+    Args:
+        db_path: SQLite 文件路径
+        wallpaper_dir: 壁纸目录
+        policy: 复用策略，缺省字段使用 DEFAULT_REUSE_POLICY
+    """
+
+    def __init__(self, db_path, wallpaper_dir, policy=None):
+        self.db_path = db_path
+        self.wallpaper_dir = wallpaper_dir
+        self._lock = threading.RLock()
+        self.policy = dict(DEFAULT_REUSE_POLICY)
+        self.set_policy(policy or {})
+        self._entries = {}
+        self._by_conditions = {}
+        self._by_prompt = {}
+        self._total_bytes = 0
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        is_new = not os.path.exists(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS wallpapers (
+            filename TEXT PRIMARY KEY,
+            prompt TEXT,
+            time_mood TEXT,
+            weather_key TEXT,
+            season TEXT,
+            width INTEGER,
+            height INTEGER,
+            format TEXT,
+            size INTEGER,
+            sha256 TEXT,
+            created_at REAL,
+            last_shown_at REAL,
+            show_count INTEGER DEFAULT 0,
+            favorite INTEGER DEFAULT 0,
+            placeholder TEXT
+        )''')
+        self._migrate()
+        self._conn.commit()
+        self._load()
+        self._import_pending = is_new
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(wallpapers)")}
+        if 'favorite' not in columns:
+            self._conn.execute("ALTER TABLE wallpapers ADD COLUMN favorite INTEGER DEFAULT 0")
+        if 'placeholder' not in columns:
+            self._conn.execute("ALTER TABLE wallpapers ADD COLUMN placeholder TEXT")
+        if 'format' not in columns:
+            self._conn.execute("ALTER TABLE wallpapers ADD COLUMN format TEXT")
+
+    def _load(self):
+        rows = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM wallpapers").fetchall()
+        for row in rows:
+            self._index(dict(zip(_COLUMNS, row)))
+        logging.info(f"[library] 已加载 {len(self._entries)} 条壁纸记录")
+
+    def start(self):
+        """首次建库时启动后台线程登记目录中已有的壁纸"""
+        if not self._import_pending:
+            return
+        self._import_pending = False
+        threading.Thread(target=self._import_untracked_files, name='wallpaper-library-import', daemon=True).start()
+
+    def _import_untracked_files(self):
+        """登记目录中已有的壁纸（生成条件未知）"""
+        count = 0
+        for name in os.listdir(self.wallpaper_dir):
+            if not name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.gif')) or self.contains(name):
+                continue
+            path = os.path.join(self.wallpaper_dir, name)
+            try:
+                stat = os.stat(path)
+                sha256 = file_sha256(path)
+            except OSError as e:
+                logging.warning(f"[library] 读取壁纸失败 {name}: {e}")
+                continue
+            try:
+                probe = probe_image_file(path)
+            except Exception as e:
+                logging.warning(f"[library] 读取壁纸尺寸失败 {name}: {e}")
+                probe = None
+            with self._lock:
+                # 导入期间新生成的壁纸已带生成信息登记，不能被覆盖
+                if name in self._entries:
+                    continue
+                self.add(name, prompt=None, time_mood=None, weather_key=None, season=None,
+                         width=probe and probe.width, height=probe and probe.height,
+                         image_format=probe and probe.format, size=stat.st_size, sha256=sha256, created_at=stat.st_mtime)
+            count += 1
+        if count:
+            logging.info(f"[library] 导入已有壁纸 {count} 张")
+
+    def _index(self, entry):
+        self._entries[entry['filename']] = entry
+        self._total_bytes += entry['size'] or 0
+        key = (entry['time_mood'], entry['weather_key'], entry['season'])
+        self._by_conditions.setdefault(key, set()).add(entry['filename'])
+        if entry['prompt']:
+            self._by_prompt[entry['prompt']] = entry['filename']
+
+    def _unindex(self, filename):
+        entry = self._entries.pop(filename, None)
+        if entry is None:
+            return None
+        self._total_bytes -= entry['size'] or 0
+        key = (entry['time_mood'], entry['weather_key'], entry['season'])
+        names = self._by_conditions.get(key)
+        if names:
+            names.discard(filename)
+            if not names:
+                del self._by_conditions[key]
+        if entry['prompt'] and self._by_prompt.get(entry['prompt']) == filename:
+            del self._by_prompt[entry['prompt']]
+        return entry
+
+    def add(self, filename, prompt, time_mood, weather_key, season,
+            width=None, height=None, image_format=None, size=None, sha256=None, created_at=None,
+            placeholder=None):
+        """登记一张壁纸，已存在时覆盖生成信息，保留展示记录、收藏和占位图"""
+        path = os.path.join(self.wallpaper_dir, filename)
+        if size is None and os.path.exists(path):
+            size = os.path.getsize(path)
+        if sha256 is None and os.path.exists(path):
+            sha256 = file_sha256(path)
+        entry = {
+            'filename': filename,
+            'prompt': prompt,
+            'time_mood': time_mood,
+            'weather_key': weather_key,
+            'season': season,
+            'width': width,
+            'height': height,
+            'format': image_format,
+            'size': size,
+            'sha256': sha256,
+            'created_at': created_at or time.time(),
+            'last_shown_at': None,
+            'show_count': 0,
+            'favorite': 0,
+            'placeholder': placeholder
+        }
+        with self._lock:
+            old = self._unindex(filename)
+            if old is not None:
+                # 展示记录决定磁盘清理的淘汰顺序和 min_repeat_interval，不能因为重新登记而清空
+                entry['last_shown_at'] = old['last_shown_at']
+                entry['show_count'] = old['show_count']
+                entry['favorite'] = old['favorite']
+                entry['placeholder'] = entry['placeholder'] or old['placeholder']
+            self._index(entry)
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO wallpapers ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                [entry[c] for c in _COLUMNS])
+            self._conn.commit()
+        return entry
+
+    def remove(self, filename):
+        with self._lock:
+            entry = self._unindex(filename)
+            self._conn.execute("DELETE FROM wallpapers WHERE filename = ?", (filename,))
+            self._conn.commit()
+        return entry
+
+    def get(self, filename):
+        with self._lock:
+            return self._entries.get(filename)
+
+    def contains(self, filename):
+        with self._lock:
+            return filename in self._entries
+
+    def find_by_prompt(self, prompt):
+        """按提示词查找已下载的壁纸，同一提示词和种子生成的图片相同，可以直接复用"""
+        with self._lock:
+            filename = self._by_prompt.get(prompt)
+            return self._entries.get(filename) if filename else None
+
+    def prompt_recently_shown(self, prompt, now=None):
+        """该提示词对应的壁纸是否在 min_repeat_interval 内展示过（包括当前壁纸）"""
+        now = now or time.time()
+        with self._lock:
+            filename = self._by_prompt.get(prompt)
+            entry = self._entries.get(filename) if filename else None
+            if entry is None or entry['last_shown_at'] is None:
+                return False
+            return now - entry['last_shown_at'] < self.policy['min_repeat_interval']
+
+    def mark_shown(self, filename, shown_at=None):
+        shown_at = shown_at or time.time()
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None:
+                return
+            entry['last_shown_at'] = shown_at
+            entry['show_count'] = (entry['show_count'] or 0) + 1
+            self._conn.execute("UPDATE wallpapers SET last_shown_at = ?, show_count = ? WHERE filename = ?",
+                               (shown_at, entry['show_count'], filename))
+            self._conn.commit()
+
+    def set_favorite(self, filename, favorite=True):
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None:
+                return False
+            entry['favorite'] = 1 if favorite else 0
+            self._conn.execute("UPDATE wallpapers SET favorite = ? WHERE filename = ?", (entry['favorite'], filename))
+            self._conn.commit()
+        return True
+
+    def set_placeholder(self, filename, placeholder):
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None:
+                return False
+            entry['placeholder'] = placeholder
+            self._conn.execute("UPDATE wallpapers SET placeholder = ? WHERE filename = ?", (placeholder, filename))
+            self._conn.commit()
+        return True
+
+    def entries(self):
+        """所有记录的快照"""
+        with self._lock:
+            return [dict(e) for e in self._entries.values()]
+
+    def total_bytes(self):
+        with self._lock:
+            return self._total_bytes
+
+    def set_policy(self, policy):
+        """
+        更新复用策略，只修改传入的字段
+
+        Raises:
+            ValueError: 未知字段或取值不合法
+        """
+        updated = dict(self.policy)
+        for key, value in policy.items():
+            if key not in DEFAULT_REUSE_POLICY:
+                raise ValueError(f"未知的复用策略字段: {key}")
+            if key == 'enabled':
+                if not isinstance(value, bool):
+                    raise ValueError('enabled 必须是布尔值')
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"{key} 必须是非负数")
+            elif key == 'reuse_probability' and value > 1:
+                raise ValueError('reuse_probability 必须在 0~1 之间')
+            updated[key] = value
+        with self._lock:
+            self.policy = updated
+        return dict(updated)
+
+    def pick(self, time_mood, weather_key, season, exclude=None):
+        """
+        按复用策略挑选一张同条件且最近未展示的壁纸
+
+        Returns:
+            壁纸记录，没有合适的壁纸或策略要求重新生成时返回 None
+        """
+        policy = self.policy
+        if not policy['enabled']:
+            return None
+        now = time.time()
+        with self._lock:
+            names = self._by_conditions.get((time_mood, weather_key, season), set())
+            if len(names) < policy['min_pool_size']:
+                return None
+            if random.random() > policy['reuse_probability']:
+                return None
+            candidates = [
+                self._entries[n] for n in names
+                if n != exclude and (self._entries[n]['last_shown_at'] is None
+                                     or now - self._entries[n]['last_shown_at'] >= policy['min_repeat_interval'])
+            ]
+        random.shuffle(candidates)
+        for entry in candidates:
+            if os.path.exists(os.path.join(self.wallpaper_dir, entry['filename'])):
+                return entry
+            logging.info(f"[library] 壁纸文件已不存在，移除记录: {entry['filename']}")
+            self.remove(entry['filename'])
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'total': len(self._entries),
+                'total_bytes': self._total_bytes,
+                'conditions': len(self._by_conditions),
+                'policy': dict(self.policy)
+            }
@@ -0,0 +1,104 @@
+import datetime
+import logging
+import threading
+
+from ai_image.make_prompt import get_next_time_mood_boundary, get_season
+from wallpaper.job_queue import PRIORITY_PREFETCH
+
+# 提前多久开始预生成下一个时间段的壁纸（秒）
+DEFAULT_LEAD_TIME = 10 * 60
+
+
+class WallpaperPrefetcher:
+    """
+    在时间段切换前预先生成下一时间段的壁纸
+
+    预生成任务以最低优先级提交到任务队列，完成后记录在 prepared 中；
+    到达切换时刻时通过 take() 直接取出已生成的文件，无需等待 LLM 和下载。
+
+    Args:
+        job_queue: WallpaperJobQueue 实例
+        lead_time: 提前量（秒）
+    """
+
+    def __init__(self, job_queue, lead_time=DEFAULT_LEAD_TIME):
+        self.job_queue = job_queue
+        self.lead_time = lead_time
+        self._lock = threading.Lock()
+        self._prepared = {}
+        self._pending = {}
+        self._stats = {'scheduled': 0, 'prepared': 0, 'hits': 0, 'misses': 0, 'failed': 0}
+
+    def plan(self, weather_key, now=None):
+        """
+        如果距离下一个时间段切换不足 lead_time，提交预生成任务
+
+        Returns:
+            提交的任务，没有提交时返回 None
+        """
+        now = now or datetime.datetime.now()
+        boundary, next_mood = get_next_time_mood_boundary(now)
+        key = (next_mood, weather_key)
+        with self._lock:
+            self._prune(now)
+            if (boundary - now).total_seconds() > self.lead_time:
+                return None
+            if key in self._prepared or key in self._pending:
+                return None
+            job = self.job_queue.submit(PRIORITY_PREFETCH, 'prefetch', time_mood=next_mood, weather_key=weather_key,
+                                        season=get_season(boundary), boundary=boundary.timestamp())
+            self._pending[key] = job
+            self._stats['scheduled'] += 1
+        logging.info(f"[prefetch] 预生成 {boundary.strftime('%H:%M')} 的壁纸: {next_mood}, {weather_key}")
+        return job
+
+    def _prune(self, now):
+        # 丢弃切换时刻已过去一小时仍未使用的预生成结果
+        expire_ts = now.timestamp() - 3600
+        for key in [k for k, v in self._prepared.items() if v['boundary'] < expire_ts]:
+            del self._prepared[key]
+
+    def complete(self, job, prompt, filename):
+        """预生成任务成功后调用"""
+        key = (job.params['time_mood'], job.params['weather_key'])
+        with self._lock:
+            self._pending.pop(key, None)
+            self._prepared[key] = {'prompt': prompt, 'filename': filename, 'boundary': job.params['boundary']}
+            self._stats['prepared'] += 1
+
+    def fail(self, job):
+        key = (job.params['time_mood'], job.params['weather_key'])
+        with self._lock:
+            self._pending.pop(key, None)
+            self._stats['failed'] += 1
+
+    def take(self, time_mood, weather_key):
+        """
+        取出已预生成的壁纸，尚未开始执行的预生成任务会被取消，由调用方直接生成
+
+        预生成和定时生成在任务队列的同一个通道中依次执行，调用方执行时预生成
+        要么已经结束，要么还在排队，不需要等待进行中的预生成
+
+        Returns:
+            {'prompt', 'filename', 'boundary'}，没有可用结果时返回 None
+        """
+        key = (time_mood, weather_key)
+        with self._lock:
+            job = self._pending.get(key)
+        if job is not None and self.job_queue.cancel(job):
+            with self._lock:
+                self._pending.pop(key, None)
+        with self._lock:
+            prepared = self._prepared.pop(key, None)
+            self._stats['hits' if prepared else 'misses'] += 1
+        return prepared
+
+    def pinned(self):
+        """已预生成但尚未使用的文件，不能被磁盘清理淘汰"""
+        with self._lock:
+            return {v['filename'] for v in self._prepared.values()}
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'pending': len(self._pending), 'ready': len(self._prepared),
+                    'lead_time': self.lead_time}
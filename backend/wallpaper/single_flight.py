@@ -0,0 +1,77 @@
+import logging
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    同一个 key 的并发调用只执行一次，其余调用者等待并共享结果
+
+    Args:
+        name: 名称，用于日志和统计
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'calls': 0, 'executions': 0, 'coalesced': 0, 'errors': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行 fn(*args, **kwargs)，如果相同 key 正在执行则等待其结果
+
+        Returns:
+            (result, shared) shared 为 True 表示复用了其他调用者的结果
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats['executions'] += 1
+                leader = True
+
+        if not leader:
+            logging.info(f"[single_flight:{self.name}] 合并到正在进行的调用: {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._stats['errors'] += 1
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return list(self._calls.keys())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
@@ -0,0 +1,39 @@
+import json
+import logging
+import os
+import threading
+
+
+class StateStore:
+    """
+    后端运行状态快照，保存为 JSON 文件
+
+    写入时先写临时文件再原子替换，进程中途退出也不会留下损坏的快照。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def load(self):
+        """读取快照，不存在或损坏时返回空字典"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return state if isinstance(state, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"[state_store] 读取状态快照失败: {e}")
+            return {}
+
+    def save(self, state):
+        tmp_path = self.path + '.tmp'
+        with self._lock:
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logging.warning(f"[state_store] 保存状态快照失败: {e}")
@@ -1,4 +1,18 @@
-import requests
+import logging
+import queue
+import threading
+import time
+try:
+    from net import http_client
+except ImportError:
+    # 单独运行模块时退回到 requests
+    import requests as http_client
+try:
+    from weather.ip_region_db import IpRegionDB
+    from weather.location_cache import get_public_ip
+except ImportError:
+    from ip_region_db import IpRegionDB
+    from location_cache import get_public_ip
 
 def get_location_by_iqiyi_api(ip='', timeout=3):
     """
@@ -6,7 +20,7 @@ def get_location_by_iqiyi_api(ip='', timeout=3):
     """
     url = f'https://mesh.if.iqiyi.com/aid/ip/info?version=1.1.1&ip={ip}'
     try:
-        resp = requests.get(url, timeout=timeout)
+        resp = http_client.get(url, timeout=timeout)
         data = resp.json()
         if data.get('code') == '0' and data.get('msg') == 'success':
             location_data = data.get('data', {})
@@ -30,7 +44,7 @@ def get_location_by_vore_api(ip='', timeout=3):
     """
     url = 'https://api.vore.top/api/IPdata?ip=' + ip
     try:
-        resp = requests.get(url, timeout=timeout)
+        resp = http_client.get(url, timeout=timeout)
         data = resp.json()
         if data.get('code') == 200:
             ipdata = data.get('ipdata', {})
@@ -52,21 +66,143 @@ def get_location_by_vore_api(ip='', timeout=3):
     except Exception as e:
         return {'province': '', 'city': '', 'county': '', 'error': str(e)}
 
-def get_location_by_ip(ip='', timeout=5):
+class LocationResolver:
     """
-    获取IP位置信息，优先使用爱奇艺API，失败时使用备用API
+    并发竞速的IP定位
+
+    先请求当前评分最好的接口，hedge_delay 秒内没有结果再同时请求下一个接口，
+    取第一个有效结果，其余请求的结果直接丢弃。每个接口记录耗时和成功率，
+    持续变慢或失败的接口会自动排到后面。
+
+    Args:
+        providers: [(名称, 查询函数)]，查询函数签名为 fn(ip, timeout)
+        hedge_delay: 启动下一个接口前等待的秒数
     """
-    # 首先尝试使用爱奇艺API
-    result = get_location_by_iqiyi_api(ip, timeout)
 
-    # 如果爱奇艺API失败，使用原有的vore API作为备用
-    if 'error' in result:
-        print(f"爱奇艺API获取位置失败: {result['error']}, 尝试使用备用API")
-        result = get_location_by_vore_api(ip, timeout)
-        if 'error' in result:
-            print(f"备用API也失败: {result['error']}")
+    def __init__(self, providers, hedge_delay=0.8):
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self._lock = threading.Lock()
+        self._stats = {
+            name: {'calls': 0, 'successes': 0, 'failures': 0, 'wins': 0, 'in_flight': 0, 'ewma_ms': None}
+            for name, _ in providers
+        }
+
+    def _score(self, name):
+        stats = self._stats[name]
+        if stats['ewma_ms'] is None:
+            # 未测量过的接口优先尝试一次，首个请求还没返回则视为慢于 hedge_delay
+            return self.hedge_delay * 2000 if stats['in_flight'] else 0
+        failure_rate = stats['failures'] / stats['calls'] if stats['calls'] else 0
+        return stats['ewma_ms'] * (1 + 4 * failure_rate)
+
+    def ranked_providers(self):
+        with self._lock:
+            return sorted(self.providers, key=lambda p: self._score(p[0]))
+
+    def _record(self, name, elapsed_ms, ok):
+        with self._lock:
+            stats = self._stats[name]
+            stats['calls'] += 1
+            stats['in_flight'] -= 1
+            stats['successes' if ok else 'failures'] += 1
+            if stats['ewma_ms'] is None:
+                stats['ewma_ms'] = elapsed_ms
+            else:
+                stats['ewma_ms'] = 0.7 * stats['ewma_ms'] + 0.3 * elapsed_ms
+
+    def resolve(self, ip='', timeout=5):
+        results = queue.Queue()
+
+        def _query(name, fn):
+            start = time.perf_counter()
+            try:
+                result = fn(ip, timeout)
+            except Exception as e:
+                result = {'province': '', 'city': '', 'county': '', 'error': str(e)}
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            ok = 'error' not in result
+            # 失败按完整超时计入耗时，避免快速失败的接口被排到前面
+            self._record(name, elapsed_ms if ok else max(elapsed_ms, timeout * 1000), ok)
+            results.put((name, result))
+
+        pending = list(self.ranked_providers())
+        running = 0
+        last_error = None
+        deadline = time.time() + timeout + 1
+        while True:
+            # 首次、上一个接口失败或等待超过 hedge_delay 时启动下一个接口
+            if pending:
+                name, fn = pending.pop(0)
+                with self._lock:
+                    self._stats[name]['in_flight'] += 1
+                threading.Thread(target=_query, args=(name, fn), daemon=True).start()
+                running += 1
+            if running == 0:
+                break
+            wait = self.hedge_delay if pending else max(0, deadline - time.time())
+            try:
+                name, result = results.get(timeout=wait)
+            except queue.Empty:
+                if pending:
+                    continue
+                break
+            running -= 1
+            if 'error' not in result:
+                with self._lock:
+                    self._stats[name]['wins'] += 1
+                return result
+            logging.warning(f"[location] {name} 获取位置失败: {result['error']}")
+            last_error = result
+        return last_error or {'province': '', 'city': '', 'county': '', 'error': '获取位置超时'}
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stats, score=round(self._score(name), 1)) for name, stats in self._stats.items()}
+
+
+LOCATION_RESOLVER = LocationResolver([
+    ('iqiyi', get_location_by_iqiyi_api),
+    ('vore', get_location_by_vore_api)
+])
+
+# 可选的离线 IP 地区库，由 init_ip_region_db() 加载
+IP_REGION_DB = None
+
+def init_ip_region_db(path):
+    """加载离线 IP 地区库，文件不存在或无效时只使用在线接口"""
+    global IP_REGION_DB
+    try:
+        IP_REGION_DB = IpRegionDB(path)
+        logging.info(f"[location] 已加载离线IP地区库: {path}")
+    except FileNotFoundError:
+        IP_REGION_DB = None
+    except Exception as e:
+        logging.warning(f"[location] 加载离线IP地区库失败: {e}")
+        IP_REGION_DB = None
+    return IP_REGION_DB is not None
+
+def get_location_by_ip(ip='', timeout=5):
+    """
+    获取IP位置信息
+
+    有离线地区库时先查本地库（未指定 IP 时先获取公网IP），
+    查不到再由多个在线接口竞速，返回第一个有效结果。
+    LocationCache 会传入已知的公网IP，断网时本地库也能直接给出结果
+    """
+    if IP_REGION_DB is not None:
+        lookup_ip = ip or get_public_ip(timeout=min(timeout, 3))
+        result = IP_REGION_DB.lookup(lookup_ip) if lookup_ip else None
+        if result and result['province']:
+            return result
+    return LOCATION_RESOLVER.resolve(ip, timeout)
 
-    return result
+def get_location_stats():
+    """各定位接口的耗时和成功率统计"""
+    stats = LOCATION_RESOLVER.stats()
+    if IP_REGION_DB is not None:
+        stats['local_db'] = IP_REGION_DB.stats()
+    return stats
 
 # 示例用法
 if __name__ == "__main__":
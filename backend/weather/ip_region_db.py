@@ -0,0 +1,220 @@
+"""
+离线 IP 段 -> 省市区 数据库
+
+文件格式（大端序）:
+    文件头  magic(4s) version(H) reserved(H) record_count(I) region_count(I) regions_offset(I)
+    IP 段   record_count 条 (start_ip(I), end_ip(I), region_id(I))，按 start_ip 升序
+    地区表  region_count + 1 个偏移量(I)，之后是 "省|市|区" 的 UTF-8 字符串
+
+查询时用 mmap 打开文件，在 IP 段上二分查找，不需要把整个文件读入内存。目前只支持 IPv4。
+
+命令行:
+    python ip_region_db.py build ip_ranges.csv ../data/ip_region.db
+    python ip_region_db.py bench ../data/ip_region.db [--count 100000] [--http 5]
+"""
+import csv
+import ipaddress
+import logging
+import mmap
+import random
+import struct
+import threading
+import time
+
+MAGIC = b'IPRG'
+VERSION = 1
+_HEADER = struct.Struct('>4sHHIII')
+_RECORD = struct.Struct('>III')
+_U32 = struct.Struct('>I')
+
+
+def _ip_to_int(value):
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    return int(ipaddress.IPv4Address(value))
+
+
+class IpRegionDB:
+    """
+    只读的离线 IP 地区库
+
+    Args:
+        path: build_ip_region_db 生成的文件
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"IP 地区库为空: {path}")
+        magic, version, _, self.record_count, self.region_count, self._regions_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"不是有效的 IP 地区库: {path}")
+        self._strings_offset = self._regions_offset + (self.region_count + 1) * _U32.size
+        self._region_cache = {}
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'hits': 0, 'misses': 0}
+
+    def _region(self, region_id):
+        region = self._region_cache.get(region_id)
+        if region is None:
+            pos = self._regions_offset + region_id * _U32.size
+            start, end = struct.unpack_from('>II', self._mm, pos)
+            province, city, county = self._mm[self._strings_offset + start:self._strings_offset + end].decode('utf-8').split('|')
+            region = {'province': province, 'city': city, 'county': county}
+            self._region_cache[region_id] = region
+        return region
+
+    def lookup(self, ip):
+        """
+        查询 IP 所在地区
+
+        Returns:
+            {'province', 'city', 'county'}，不在库中或不是 IPv4 时返回 None
+        """
+        try:
+            value = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return None
+        mm = self._mm
+        base = _HEADER.size
+        size = _RECORD.size
+        # 找到最后一个 start_ip <= value 的 IP 段
+        lo, hi = 0, self.record_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _U32.unpack_from(mm, base + mid * size)[0] <= value:
+                lo = mid + 1
+            else:
+                hi = mid
+        result = None
+        if lo:
+            _, end, region_id = _RECORD.unpack_from(mm, base + (lo - 1) * size)
+            if value <= end:
+                result = dict(self._region(region_id))
+        with self._lock:
+            self._stats['lookups'] += 1
+            self._stats['hits' if result else 'misses'] += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'ranges': self.record_count, 'regions': self.region_count}
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+def build_ip_region_db(csv_path, out_path):
+    """
+    从 CSV 生成 IP 地区库
+
+    CSV 每行: start_ip,end_ip,province,city,county，IP 可以是点分格式或整数，
+    以 # 开头的行和无法解析的表头会被跳过。区间重叠时保留先出现的区间。
+
+    Returns:
+        写入的 IP 段数量
+    """
+    ranges = []
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for line_no, row in enumerate(csv.reader(f), 1):
+            if not row or row[0].lstrip().startswith('#'):
+                continue
+            try:
+                start, end = _ip_to_int(row[0]), _ip_to_int(row[1])
+            except (ValueError, IndexError):
+                if line_no > 1:
+                    logging.warning(f"[ip_region_db] 跳过无法解析的第 {line_no} 行: {row}")
+                continue
+            if start > end:
+                start, end = end, start
+            region = tuple((row[i].strip().replace('|', '') if len(row) > i else '') for i in (2, 3, 4))
+            ranges.append((start, end, region, line_no))
+
+    ranges.sort(key=lambda r: (r[0], r[3]))
+    regions = {}
+    records = []
+    last_end = -1
+    for start, end, region, line_no in ranges:
+        if start <= last_end:
+            logging.warning(f"[ip_region_db] 第 {line_no} 行与前一个区间重叠，已跳过")
+            continue
+        region_id = regions.setdefault(region, len(regions))
+        records.append((start, end, region_id))
+        last_end = end
+
+    strings = bytearray()
+    offsets = [0]
+    for region in regions:
+        strings += '|'.join(region).encode('utf-8')
+        offsets.append(len(strings))
+
+    regions_offset = _HEADER.size + len(records) * _RECORD.size
+    with open(out_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, 0, len(records), len(regions), regions_offset))
+        for record in records:
+            f.write(_RECORD.pack(*record))
+        for offset in offsets:
+            f.write(_U32.pack(offset))
+        f.write(strings)
+    logging.info(f"[ip_region_db] 已生成 {out_path}: {len(records)} 个IP段, {len(regions)} 个地区")
+    return len(records)
+
+
+def _bench(db_path, count, http_samples):
+    db = IpRegionDB(db_path)
+    ips = [str(ipaddress.IPv4Address(random.getrandbits(32))) for _ in range(count)]
+    start = time.perf_counter()
+    for ip in ips:
+        db.lookup(ip)
+    elapsed = time.perf_counter() - start
+    stats = db.stats()
+    print(f"本地库: {count} 次查询, 平均 {elapsed / count * 1e6:.2f} µs/次, 命中 {stats['hits']}, 未命中 {stats['misses']}")
+
+    if not http_samples:
+        return
+    try:
+        from weather.get_location import get_location_by_iqiyi_api, get_location_by_vore_api
+    except ImportError:
+        from get_location import get_location_by_iqiyi_api, get_location_by_vore_api
+    sample_ips = random.sample(ips, min(http_samples, len(ips)))
+    for name, fn in (('iqiyi', get_location_by_iqiyi_api), ('vore', get_location_by_vore_api)):
+        costs = []
+        errors = 0
+        for ip in sample_ips:
+            start = time.perf_counter()
+            result = fn(ip, timeout=5)
+            costs.append((time.perf_counter() - start) * 1000)
+            errors += 'error' in result
+        print(f"{name}: {len(costs)} 次查询, 平均 {sum(costs) / len(costs):.1f} ms/次, 失败 {errors}")
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import sys
+    # 单独运行时让 net 等模块可以导入
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='离线 IP 地区库工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help='从 CSV 生成地区库')
+    build_parser.add_argument('csv_path')
+    build_parser.add_argument('out_path')
+    bench_parser = sub.add_parser('bench', help='对比本地库和在线定位接口的耗时')
+    bench_parser.add_argument('db_path')
+    bench_parser.add_argument('--count', type=int, default=100000, help='本地查询次数')
+    bench_parser.add_argument('--http', type=int, default=0, help='每个在线接口的查询次数，0 表示不测试')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_ip_region_db(args.csv_path, args.out_path)
+    else:
+        _bench(args.db_path, args.count, args.http)
@@ -0,0 +1,229 @@
+import logging
+import socket
+import threading
+import time
+try:
+    from net import http_client
+except ImportError:
+    # 单独运行模块时退回到 requests
+    import requests as http_client
+
+# 只返回公网IP纯文本的接口，比定位接口轻量得多
+PUBLIC_IP_URLS = [
+    'https://4.ipw.cn',
+    'https://api.ipify.org'
+]
+
+
+def get_public_ip(timeout=3):
+    """获取公网IP，全部失败时返回 None"""
+    for url in PUBLIC_IP_URLS:
+        try:
+            resp = http_client.get(url, timeout=timeout)
+            ip = resp.text.strip()
+            if resp.status_code == 200 and 0 < len(ip) <= 45:
+                return ip
+        except Exception as e:
+            logging.warning(f"[location_cache] 获取公网IP失败 {url}: {e}")
+    return None
+
+
+def get_network_fingerprint():
+    """
+    本机出口网卡地址，不产生网络流量
+
+    UDP socket 的 connect 只查路由表，不会发包。切换 Wi-Fi、插拔网线、连接 VPN 时通常会变化。
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('223.5.5.5', 53))
+        return s.getsockname()[0]
+    except OSError:
+        return None
+    finally:
+        s.close()
+
+
+class LocationCache:
+    """
+    IP定位结果缓存
+
+    桌面电脑的位置很少变化，定位结果保留 ttl 秒，期间只有出现以下信号才重新定位：
+    出口网卡地址变化（每次检查，本地操作）、休眠唤醒（由 start() 启动的计时线程发现）、
+    公网IP变化（每 public_ip_interval 秒检查一次）。
+
+    网络请求都不在 _lock 内执行，stats() 等只读调用不会被重新定位阻塞；
+    并发的 get() 由 _resolve_lock 串行化，同一时间只有一次定位。
+
+    Args:
+        resolve: 定位函数 resolve(ip) -> dict，失败时返回带 'error' 的字典；
+            ip 为已知的公网IP，有离线地区库时可以直接查本地库，为空字符串时由定位函数自行获取
+        ttl: 定位结果的最长有效期（秒）
+        public_ip_interval: 检查公网IP的间隔（秒），0 表示不检查
+        resume_gap: 计时线程发现进程暂停超过该值时视为刚从休眠中恢复（秒）
+        tick_interval: 计时线程的间隔（秒）
+    """
+
+    def __init__(self, resolve, ttl=24 * 3600, public_ip_interval=30 * 60, resume_gap=15 * 60, tick_interval=60):
+        self.resolve = resolve
+        self.ttl = ttl
+        self.public_ip_interval = public_ip_interval
+        self.resume_gap = resume_gap
+        self.tick_interval = tick_interval
+        self._lock = threading.Lock()
+        self._resolve_lock = threading.Lock()
+        self._location = None
+        self._resolved_at = 0
+        self._network = None
+        self._public_ip = None
+        self._public_ip_checked_at = 0
+        self._resumed = False
+        self._last_tick = None
+        self._started = False
+        self._retry_reason = None
+        self._stats = {'calls': 0, 'resolved': 0, 'avoided': 0, 'errors': 0, 'resumes': 0, 'reasons': {}}
+
+    def start(self):
+        """启动检测休眠唤醒的计时线程"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._tick_loop, name='location-resume-tick', daemon=True).start()
+
+    def _tick_loop(self):
+        while True:
+            self.tick()
+            time.sleep(self.tick_interval)
+
+    def tick(self):
+        """
+        比较两次计时之间墙上时间和单调时间的差
+
+        Linux/macOS 的单调时钟在休眠期间不走，墙上时间多出的部分就是休眠时长；
+        Windows 的单调时钟包含休眠时间，此时计时线程本身的间隔会远超 tick_interval。
+        两者任一超过 resume_gap 都视为休眠唤醒，与有没有前端连接无关。
+        """
+        wall, mono = time.time(), time.monotonic()
+        with self._lock:
+            last, self._last_tick = self._last_tick, (wall, mono)
+            if last is None:
+                return False
+            wall_gap = wall - last[0]
+            suspended = max(wall_gap - (mono - last[1]), wall_gap - self.tick_interval)
+            if suspended < self.resume_gap:
+                return False
+            self._resumed = True
+            self._stats['resumes'] += 1
+        logging.info(f"[location_cache] 检测到休眠唤醒，暂停约 {suspended:.0f}s")
+        return True
+
+    def _reason_to_resolve(self, now):
+        """返回需要重新定位的原因，不需要时返回 None；只在 _resolve_lock 内调用"""
+        with self._lock:
+            if self._location is None:
+                return 'empty'
+            if self._retry_reason:
+                # 上次重新定位失败，继续重试
+                return self._retry_reason
+            if now - self._resolved_at >= self.ttl:
+                return 'ttl'
+            if self._resumed:
+                return 'resume'
+            known_network = self._network
+            check_public_ip = self.public_ip_interval and now - self._public_ip_checked_at >= self.public_ip_interval
+        network = get_network_fingerprint()
+        if network != known_network:
+            logging.info(f"[location_cache] 出口网卡地址变化: {known_network} -> {network}")
+            return 'network'
+        if check_public_ip:
+            public_ip = get_public_ip()
+            with self._lock:
+                self._public_ip_checked_at = now
+                changed = public_ip and public_ip != self._public_ip
+                if changed:
+                    logging.info(f"[location_cache] 公网IP变化: {self._public_ip} -> {public_ip}")
+                    self._public_ip = public_ip
+            if changed:
+                return 'public_ip'
+        return None
+
+    def _public_ip_for(self, reason):
+        """
+        定位使用的公网IP
+
+        网络可能已经变化（network/resume）或还不知道公网IP时重新获取，获取失败（如断网）时
+        退回已知的IP；其余情况直接使用已知的IP，不产生网络请求
+        """
+        with self._lock:
+            known = self._public_ip
+        if not self.public_ip_interval or (known and reason not in ('network', 'resume')):
+            return known
+        return get_public_ip() or known
+
+    def get(self):
+        """返回定位结果，格式与 get_location_by_ip 一致"""
+        with self._lock:
+            self._stats['calls'] += 1
+        with self._resolve_lock:
+            now = time.time()
+            reason = self._reason_to_resolve(now)
+            if reason is None:
+                with self._lock:
+                    self._stats['avoided'] += 1
+                    return dict(self._location)
+
+            public_ip = self._public_ip_for(reason)
+            result = self.resolve(public_ip or '')
+            if 'error' in result:
+                with self._lock:
+                    self._stats['errors'] += 1
+                    self._retry_reason = reason
+                return result
+            logging.info(f"[location_cache] 重新定位 ({reason}): {result}")
+            network = get_network_fingerprint()
+            with self._lock:
+                self._retry_reason = None
+                self._resumed = False
+                self._stats['resolved'] += 1
+                self._stats['reasons'][reason] = self._stats['reasons'].get(reason, 0) + 1
+                self._location = {k: result.get(k, '') for k in ('province', 'city', 'county')}
+                self._resolved_at = now
+                self._network = network
+                if public_ip:
+                    # 作为后续比较公网IP变化的基准
+                    self._public_ip = public_ip
+                    self._public_ip_checked_at = now
+                return dict(self._location)
+
+    def invalidate(self):
+        """下次调用时强制重新定位"""
+        with self._lock:
+            self._location = None
+
+    def snapshot(self):
+        """用于持久化的状态，重启后在同一网络下无需重新定位"""
+        with self._lock:
+            if self._location is None:
+                return None
+            return {'location': self._location, 'resolved_at': self._resolved_at,
+                    'network': self._network, 'public_ip': self._public_ip}
+
+    def restore(self, snapshot):
+        if not isinstance(snapshot, dict) or not isinstance(snapshot.get('location'), dict):
+            return
+        with self._lock:
+            self._location = snapshot['location']
+            self._resolved_at = snapshot.get('resolved_at', 0)
+            self._network = snapshot.get('network')
+            self._public_ip = snapshot.get('public_ip')
+            # 重启后先检查一次公网IP
+            self._public_ip_checked_at = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, reasons=dict(self._stats['reasons']))
+            stats['age'] = round(time.time() - self._resolved_at, 1) if self._location else None
+            stats['network'] = self._network
+            stats['public_ip'] = self._public_ip
+        return stats
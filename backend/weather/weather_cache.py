@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from wallpaper.single_flight import SingleFlight
+
+# 实况天气大约每 10~20 分钟更新一次，按观测时间推算下一次更新
+OBSERVE_INTERVAL = 15 * 60
+
+
+class WeatherCache:
+    """
+    按 (province, city, county) 缓存实况天气
+
+    过期时间根据接口返回的观测时间 update_time 推算：新观测发布之前重复请求只会拿到同样的数据。
+    并发未命中的请求合并为一次上游调用；过期但未超过 max_stale 的数据直接返回，
+    同时在后台刷新（stale-while-revalidate），路由不必等待上游。
+    上游失败且没有可用的旧数据时缓存这次错误，error_ttl 秒内直接返回，不再请求上游。
+
+    Args:
+        fetch: fetch(province, city, county) -> dict，失败时返回带 'error' 的字典
+        min_ttl / max_ttl: 过期时间的上下限（秒）
+        max_stale: 数据获取后最长可以作为旧数据返回多久（秒）
+        error_ttl: 上游失败后多久再重试（秒）
+    """
+
+    def __init__(self, fetch, min_ttl=60, max_ttl=30 * 60, max_stale=2 * 3600, error_ttl=30):
+        self.fetch = fetch
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.max_stale = max_stale
+        self.error_ttl = error_ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._refreshing = set()
+        self._flight = SingleFlight('weather')
+        self._stats = {'hits': 0, 'stale_hits': 0, 'error_hits': 0, 'misses': 0, 'upstream_calls': 0,
+                       'upstream_errors': 0}
+
+    def _ttl(self, data, now):
+        """距离下一次观测发布的秒数"""
+        try:
+            observed_at = datetime.strptime(data['update_time'], '%Y%m%d%H%M').timestamp()
+        except (KeyError, TypeError, ValueError):
+            return self.max_ttl // 2
+        return min(self.max_ttl, max(self.min_ttl, observed_at + OBSERVE_INTERVAL - now))
+
+    def _usable(self, entry, now):
+        """是否可以作为旧数据返回，缓存的错误不算"""
+        return entry is not None and not entry['error'] and now - entry['fetched_at'] < self.max_stale
+
+    def _load(self, key):
+        data = self.fetch(*key)
+        now = time.time()
+        with self._lock:
+            self._stats['upstream_calls'] += 1
+            old = self._entries.get(key)
+            if 'error' in data:
+                self._stats['upstream_errors'] += 1
+                if self._usable(old, now):
+                    # 上游失败时继续使用旧数据，error_ttl 秒后再重试
+                    old['expires_at'] = now + self.error_ttl
+                    logging.warning(f"[weather_cache] 刷新 {key} 失败，继续使用旧数据: {data['error']}")
+                    return old['data']
+                # 没有旧数据可用，缓存这次错误，避免上游故障期间每次请求都等待超时
+                self._entries[key] = {'data': data, 'fetched_at': now, 'expires_at': now + self.error_ttl,
+                                      'error': True}
+                return data
+            self._entries[key] = {'data': data, 'fetched_at': now, 'expires_at': now + self._ttl(data, now),
+                                  'error': False}
+        return data
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _run():
+            try:
+                self._flight.do(key, self._load, key)
+            except Exception as e:
+                logging.warning(f"[weather_cache] 后台刷新 {key} 失败: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=_run, name='weather-refresh', daemon=True).start()
+
+    def get(self, province, city, county):
+        """返回天气数据字典，与 get_qq_weather 的返回格式一致"""
+        key = (province, city, county)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry['expires_at']:
+                self._stats['error_hits' if entry['error'] else 'hits'] += 1
+                return entry['data']
+            stale = self._usable(entry, now)
+            self._stats['stale_hits' if stale else 'misses'] += 1
+        if stale:
+            self._refresh_in_background(key)
+            return entry['data']
+        data, _ = self._flight.do(key, self._load, key)
+        return data
+
+    def invalidate(self, province=None, city=None, county=None):
+        """清除某个位置或全部缓存"""
+        with self._lock:
+            if province is None and city is None and county is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((province, city, county), None)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = {
+                '|'.join(key): {'age': round(now - e['fetched_at'], 1), 'expires_in': round(e['expires_at'] - now, 1)}
+                for key, e in self._entries.items()
+            }
+        stats['coalesced'] = self._flight.stats()['coalesced']
+        return stats
@@ -1,4 +1,8 @@
-import requests
+try:
+    from net import http_client
+except ImportError:
+    # 单独运行模块时退回到 requests
+    import requests as http_client
 from flask import jsonify, request
 
 def get_qq_weather(province, city, county):
@@ -11,7 +15,7 @@ def get_qq_weather(province, city, county):
         "county": county
     }
     try:
-        resp = requests.get(url, params=params, timeout=5)
+        resp = http_client.get(url, params=params, timeout=5)
         data = resp.json()
         if data.get("status") == 200:
             observe = data["data"].get("observe", {})